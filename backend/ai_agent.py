@@ -1,66 +1,149 @@
-print("✅ ai_agent.py laddas in")
+# backend/ai_agent.py
+"""
+AI-planering av veckans matsedel.
 
+Importen ska vara billig och fri från sidoeffekter (den görs lazy i
+/api/byt-middag och i planeringsprocessen). .env, loggning, konfig och
+Supabase/OpenAI-klienter sätts upp först när de behövs, via _init(),
+get_supabase(), get_openai(), get_http() och get_config().
+"""
 import os
 import json
-import uuid
 import logging
 import datetime
+import threading
+import time
 from collections import defaultdict
-from pathlib import Path  # <-- lägg till denna rad
-
-import requests
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from openai import OpenAI
+from pathlib import Path
 
 # --- Paths (robusta) ---
 HERE = Path(__file__).resolve().parent
 DATA_DIR = (HERE / "../data").resolve()
-DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 LOG_PATH = DATA_DIR / "middag_logg.txt"
 
-# --- Logging: init efter att katalogen finns ---
-for h in logging.root.handlers[:]:
-    logging.root.removeHandler(h)
-logging.basicConfig(
-    filename=str(LOG_PATH),
-    level=logging.INFO,
-    format="%(asctime)s - %(message)s"
-)
-logging.info("🪵 ai_agent.py importerad")
-
-# --- Miljö ---
-# Ladda .env i backend-katalogen (utöver systemd EnvironmentFile)
-load_dotenv(HERE / ".env")
-print("✅ .env laddad")
-print("🔑 SUPABASE_URL:", os.getenv("SUPABASE_URL"))
-print("🔑 OPENAI_API_KEY finns:", bool(os.getenv("OPENAI_API_KEY")))
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-OPENAI_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
-OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "1"))
-OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "1500"))
-INPUT_PRICE = float(os.getenv("OPENAI_INPUT_PRICE_PER_1K", "0"))
-OUTPUT_PRICE = float(os.getenv("OPENAI_OUTPUT_PRICE_PER_1K", "0"))
-USD_TO_SEK = float(os.getenv("USD_TO_SEK", "1"))
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-openai = OpenAI(api_key=OPENAI_KEY)
+# Egen logger till middag_logg.txt – rör inte root-loggern (Flask/gunicorn)
+log = logging.getLogger("ai_agent")
+
+# --- Miljö (fylls i av _init()) ---
+SUPABASE_URL = None
+SUPABASE_KEY = None
+OPENAI_KEY = None
+OPENAI_MODEL = "gpt-4"
+OPENAI_TEMPERATURE = 1.0
+OPENAI_MAX_TOKENS = 1500
+INPUT_PRICE = 0.0
+OUTPUT_PRICE = 0.0
+USD_TO_SEK = 1.0
+SCHOOL_LUNCH_URL = None
+SCHOOL_LUNCH_VERIFY_SSL = True
+CONTEXT_DEADLINE_S = 20.0
+
+_init_lock = threading.Lock()
+_initialized = False
+_supabase = None
+_openai = None
+_http = None
+
+
+def _init():
+    """Ladda .env, läs miljön och koppla loggfilen – en gång per process."""
+    global _initialized, SUPABASE_URL, SUPABASE_KEY, OPENAI_KEY, OPENAI_MODEL, OPENAI_TEMPERATURE
+    global OPENAI_MAX_TOKENS, INPUT_PRICE, OUTPUT_PRICE, USD_TO_SEK, SCHOOL_LUNCH_URL, SCHOOL_LUNCH_VERIFY_SSL
+    global CONTEXT_DEADLINE_S
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        if not log.handlers:
+            handler = logging.FileHandler(str(LOG_PATH), encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+            log.addHandler(handler)
+            log.setLevel(logging.INFO)
+            log.propagate = False
+
+        # Ladda .env i backend-katalogen (utöver systemd EnvironmentFile)
+        from dotenv import load_dotenv
+        load_dotenv(HERE / ".env")
+
+        SUPABASE_URL = os.getenv("SUPABASE_URL")
+        SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+        OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+        OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
+        OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "1"))
+        OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "1500"))
+        INPUT_PRICE = float(os.getenv("OPENAI_INPUT_PRICE_PER_1K", "0"))
+        OUTPUT_PRICE = float(os.getenv("OPENAI_OUTPUT_PRICE_PER_1K", "0"))
+        USD_TO_SEK = float(os.getenv("USD_TO_SEK", "1"))
+        SCHOOL_LUNCH_URL = os.getenv("SCHOOL_LUNCH_URL", "https://192.168.50.230:3443")
+        SCHOOL_LUNCH_VERIFY_SSL = os.getenv("SCHOOL_LUNCH_VERIFY_SSL", "true").lower() == "true"
+        # Gemensam deadline för skolmat/middagar/gillade innan prompten byggs
+        CONTEXT_DEADLINE_S = float(os.getenv("AI_CONTEXT_DEADLINE_S", "20"))
+
+        log.info("🪵 ai_agent initierad (SUPABASE_URL=%s, OPENAI_API_KEY finns: %s)",
+                 SUPABASE_URL, bool(OPENAI_KEY))
+        _initialized = True
+
+
+def get_supabase():
+    """Delad Supabase-klient, skapas vid första anropet."""
+    global _supabase
+    if _supabase is None:
+        _init()
+        with _init_lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
+
+
+def get_openai():
+    """Delad OpenAI-klient, skapas vid första anropet."""
+    global _openai
+    if _openai is None:
+        _init()
+        with _init_lock:
+            if _openai is None:
+                from openai import OpenAI
+                _openai = OpenAI(api_key=OPENAI_KEY)
+    return _openai
+
+
+def get_http():
+    """Delad requests.Session – anslutningar återanvänds mellan körningar."""
+    global _http
+    if _http is None:
+        _init()
+        with _init_lock:
+            if _http is None:
+                import requests
+                _http = requests.Session()
+    return _http
+
+
+def warm():
+    """Skapa alla klienter i förväg (används av den långlivade planeringsprocessen)."""
+    get_supabase()
+    get_openai()
+    get_http()
+    get_config()
+
 
 # ------------------------------
 # Konstanter / preferenser (laddas från .secrets)
 # ------------------------------
-def _load_ai_config():
-    """Läs personlig konfig från AI_CONFIG_PATH eller använda bra defaults."""
-    # Sökordning: env -> ../.secrets -> ./.secrets
+def _ai_config_path() -> Path:
+    # Sökordning: env -> ../.secrets
     env_path = os.getenv("AI_CONFIG_PATH")
     if env_path:
-        path = Path(env_path).expanduser().resolve()
-    else:
-        path = (HERE / "../.secrets/ai_config.json")
+        return Path(env_path).expanduser().resolve()
+    return HERE / "../.secrets/ai_config.json"
+
+
+def _load_ai_config(path: Path):
+    """Läs personlig konfig från AI_CONFIG_PATH eller använda bra defaults."""
     cfg = {}
     try:
         with open(path, "r", encoding="utf-8") as f:
@@ -74,10 +157,27 @@ def _load_ai_config():
         "FORBIDDEN_INGREDIENTS": cfg.get("FORBIDDEN_INGREDIENTS", ["jordnöt"])
     }
 
-_CFG = _load_ai_config()
-ALLERGIES = _CFG["ALLERGIES"]
-PREFERENCES = _CFG["PREFERENCES"]
-FORBIDDEN_INGREDIENTS = _CFG["FORBIDDEN_INGREDIENTS"]
+
+_cfg = None
+_cfg_stamp = None
+
+
+def get_config() -> dict:
+    """
+    ALLERGIES / PREFERENCES / FORBIDDEN_INGREDIENTS. Läses om när filen ändras,
+    så att en långlivad process inte kör vidare med gammal konfig.
+    """
+    global _cfg, _cfg_stamp
+    _init()
+    path = _ai_config_path()
+    try:
+        stamp = (str(path), path.stat().st_mtime_ns)
+    except OSError:
+        stamp = (str(path), None)
+    if _cfg is None or stamp != _cfg_stamp:
+        _cfg, _cfg_stamp = _load_ai_config(path), stamp
+    return _cfg
+
 
 STATUS_PATH = str(DATA_DIR / "ai_status.json")
 MATSEDEL_PATH = str(DATA_DIR / "matsedel.json")
@@ -119,8 +219,6 @@ CATEGORY_MAP = {
     "Dressing": "Såser",
 }
 
-SCHOOL_LUNCH_URL = os.getenv("SCHOOL_LUNCH_URL", "https://192.168.50.230:3443")
-SCHOOL_LUNCH_VERIFY_SSL = os.getenv("SCHOOL_LUNCH_VERIFY_SSL", "true").lower() == "true"
 
 # ------------------------------
 # Hjälpfunktioner
@@ -145,15 +243,17 @@ def _norm_day(s: str) -> str:
     return mapping.get(s, s).capitalize()
 
 
-def fetch_school_lunches():
+def fetch_school_lunches(deadline=None):
     """
     Hämtar skolmaten via /api/mealplan/school-lunch.
     Returnerar lista av {"dag": "Måndag", "beskrivning": "..."}.
-    Robust mot SSL-bekymmer och http/https.
+    Robust mot SSL-bekymmer och http/https. Med deadline (time.monotonic())
+    kortas timeouten per försök och inga nya försök görs efter den.
     """
+    _init()
     base = (SCHOOL_LUNCH_URL or "").rstrip("/")
     if not base:
-        logging.info("Ingen SCHOOL_LUNCH_URL satt; hoppar över skolmat.")
+        log.info("Ingen SCHOOL_LUNCH_URL satt; hoppar över skolmat.")
         return []
 
     url_https = f"{base}/api/mealplan/school-lunch"
@@ -164,9 +264,15 @@ def fetch_school_lunches():
 
     last_err = None
     for c in candidates:
+        timeout = 12.0
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                last_err = last_err or TimeoutError("deadline passerad")
+                break
         try:
-            logging.info("🍽️ Hämtar skolmat från %s (verify=%s)...", c["url"], c["verify"])
-            res = requests.get(c["url"], timeout=12, verify=c["verify"])
+            log.info("🍽️ Hämtar skolmat från %s (verify=%s)...", c["url"], c["verify"])
+            res = get_http().get(c["url"], timeout=timeout, verify=c["verify"])
             res.raise_for_status()
             data = res.json() or {}
             dagar = data.get("dagar") or []
@@ -175,19 +281,19 @@ def fetch_school_lunches():
                 dag_raw = d.get("dag") or d.get("Dag") or d.get("weekday") or ""
                 beskrivning = d.get("beskrivning") or d.get("Beskrivning") or d.get("description") or ""
                 normalized.append({"dag": _norm_day(dag_raw), "beskrivning": (beskrivning or "").strip()})
-            logging.info("✅ Skolmat hämtad (%d dagar).", len(normalized))
+            log.info("✅ Skolmat hämtad (%d dagar).", len(normalized))
             return normalized
         except Exception as e:
             last_err = e
-            logging.warning("⚠️ Misslyckades med %s (%s). Provar nästa...", c["url"], e)
-    logging.warning("❌ Kunde inte hämta skolmat: %s", last_err)
+            log.warning("⚠️ Misslyckades med %s (%s). Provar nästa...", c["url"], e)
+    log.warning("❌ Kunde inte hämta skolmat: %s", last_err)
     return []
 
 
 def fetch_liked_meals(limit=10):
     """Hämta mest gillade rätter (titlar) och returnera topp N."""
-    logging.info("🔍 Hämtar gillade måltider...")
-    res = supabase.table("meal_likes").select("titel").limit(200).execute()
+    log.info("🔍 Hämtar gillade måltider...")
+    res = get_supabase().table("meal_likes").select("titel").limit(200).execute()
     titles = [r["titel"] for r in (res.data or []) if r.get("titel")]
     freq = defaultdict(int)
     for t in titles:
@@ -199,7 +305,7 @@ def fetch_liked_meals(limit=10):
 def fetch_recent_dinners():
     """Hämta middagar från senaste 4 veckorna (exkl. tacos) för att undvika upprepning."""
     recent_weeks = [get_current_week() - i for i in range(1, 5)]
-    res = supabase.table("mealplan").select("data").in_("vecka", recent_weeks).execute()
+    res = get_supabase().table("mealplan").select("data").in_("vecka", recent_weeks).execute()
     dinners = []
     for row in (res.data or []):
         dagar = (row.get("data") or {}).get("dagar", [])
@@ -212,6 +318,41 @@ def fetch_recent_dinners():
     return dinners
 
 
+def gather_context(include_lunches=True):
+    """
+    Hämtar skolmat, senaste middagar och gillade rätter parallellt under en
+    gemensam deadline (AI_CONTEXT_DEADLINE_S). En källa som fallerar eller
+    inte hinner klart blir en tom lista, så att planeringen ändå kan köras.
+    Returnerar {"school_lunches": [...], "recent_dinners": [...], "liked_meals": [...]}.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait
+
+    _init()
+    t0 = time.monotonic()
+    deadline = t0 + CONTEXT_DEADLINE_S
+    pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="ai-context")
+    futures = {
+        "recent_dinners": pool.submit(fetch_recent_dinners),
+        "liked_meals": pool.submit(fetch_liked_meals),
+    }
+    if include_lunches:
+        futures["school_lunches"] = pool.submit(fetch_school_lunches, deadline)
+    wait(futures.values(), timeout=CONTEXT_DEADLINE_S)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    context = {"school_lunches": [], "recent_dinners": [], "liked_meals": []}
+    for name, fut in futures.items():
+        if not fut.done():
+            log.warning("⏱️ %s hann inte hämtas inom %.0f s; fortsätter utan.", name, CONTEXT_DEADLINE_S)
+            continue
+        try:
+            context[name] = fut.result()
+        except Exception as e:
+            log.warning("⚠️ Kunde inte hämta %s: %s; fortsätter utan.", name, e)
+    log.info("📦 Kontext hämtad på %.2f s.", time.monotonic() - t0)
+    return context
+
+
 def is_spice(name: str) -> bool:
     return any(word in name.lower() for word in CATEGORIES_TO_SKIP)
 
@@ -224,6 +365,7 @@ def build_shopping_items(matsedel: dict, week: int):
     Bygger inköpslista från alla middags-ingredienser i en matsedel/plan.
     Aggregerar mängder när det går. Skippar kryddor.
     """
+    import uuid  # lazy: uuid drar in platform m.m. (~4 ms) vid import
     print("Extraherar shoppinglist...")
     grouped = defaultdict(lambda: {"amount": 0, "unit": None})
 
@@ -287,17 +429,17 @@ build_shopping_items = build_shopping_items
 
 def upload_shoppinglist(week: int, items: list):
     print("Rensar tidigare AI-shoppinglist för veckan...")
-    supabase.table("shoppinglist").delete().eq("week", week).eq("source", "ai").execute()
+    get_supabase().table("shoppinglist").delete().eq("week", week).eq("source", "ai").execute()
     print("Laddar upp shoppinglist...")
     if items:
-        supabase.table("shoppinglist").insert(items).execute()
+        get_supabase().table("shoppinglist").insert(items).execute()
 
 
 def upload_mealplan(week: int, matsedel: dict):
     print("Rensar tidigare mealplan för veckan...")
-    supabase.table("mealplan").delete().eq("vecka", week).execute()
+    get_supabase().table("mealplan").delete().eq("vecka", week).execute()
     print("Laddar upp mealplan...")
-    supabase.table("mealplan").insert({"vecka": week, "data": matsedel}).execute()
+    get_supabase().table("mealplan").insert({"vecka": week, "data": matsedel}).execute()
 
 
 def save_matsedel_local(matsedel: dict):
@@ -319,11 +461,12 @@ def log_status(success: bool, message: str):
 # ------------------------------
 def build_prompt(school_lunches, recent_dinners, liked_meals):
     lunch_text = "\n".join(f"{d['dag']}: {d['beskrivning']}" for d in school_lunches)
+    cfg = get_config()
     return f'''
 Du är en svensk matinspiratör som planerar matsedel för en familj med två vuxna och två barn.
 
-- Allergier: {', '.join(ALLERGIES)}
-- Preferenser: {PREFERENCES}
+- Allergier: {', '.join(cfg['ALLERGIES'])}
+- Preferenser: {cfg['PREFERENCES']}
 - Familjen har gillat dessa rätter tidigare: {json.dumps(liked_meals, ensure_ascii=False)}
   Använd gärna liknande smaker som inspiration.
 - Kalorimål: ca 700-900 kcal/middag för vuxna (totalt 1500 kcal/dag)
@@ -372,14 +515,14 @@ Returnera ENDAST ett giltigt JSON-objekt enligt:
 '''
 
 
-def generate_meal_plan():
+def generate_meal_plan(context=None):
     print("🤖 Börjar generera matsedel...")
-    school_lunches = fetch_school_lunches()
-    recent_dinners = fetch_recent_dinners()
-    liked_meals = fetch_liked_meals()
-    prompt = build_prompt(school_lunches, recent_dinners, liked_meals)
+    _init()
+    if context is None:
+        context = gather_context()
+    prompt = build_prompt(context["school_lunches"], context["recent_dinners"], context["liked_meals"])
 
-    completion = openai.chat.completions.create(
+    completion = get_openai().chat.completions.create(
         model=OPENAI_MODEL,
         messages=[{"role": "user", "content": prompt}],
         temperature=OPENAI_TEMPERATURE
@@ -392,13 +535,13 @@ def generate_meal_plan():
     cost_usd = (pt/1000.0)*INPUT_PRICE + (ct/1000.0)*OUTPUT_PRICE
     cost_sek = cost_usd * USD_TO_SEK
 
-    logging.info(
+    log.info(
         f"💰Generering av Veckomeny: Tokens prompt={pt}, completion={ct}, total={pt+ct}. "
         f"Cost ≈ ${cost_usd:.4f} (~{cost_sek:.2f} SEK)"
     )
     print(f"[COST] prompt={pt}, completion={ct}, total={pt+ct}, ~${cost_usd:.4f} (~{cost_sek:.2f} SEK)")
     print("GPT response:", raw)
-    logging.info("🧠 GPT-svar i veckoplanering:\n%s", raw)
+    log.info("🧠 GPT-svar i veckoplanering:\n%s", raw)
     return json.loads(raw)
 
 
@@ -416,7 +559,7 @@ def _ensure_weekday_lunches(matsedel: dict, school_lunches: list) -> dict:
                 dag["lunch"] = {"titel": by_day[name], "recept": None, "kalorier": None}
                 patched += 1
     if patched:
-        logging.info("🩹 Fyllde i lunch för %d vardagar baserat på skolmaten.", patched)
+        log.info("🩹 Fyllde i lunch för %d vardagar baserat på skolmaten.", patched)
     return matsedel
 
 
@@ -427,19 +570,22 @@ def _is_safe(middag: dict) -> bool:
     if not middag:
         return False
     combined = (middag.get("titel", "") + " " + " ".join(middag.get("ingredienser", []))).lower()
-    for word in FORBIDDEN_INGREDIENTS:
+    for word in get_config()["FORBIDDEN_INGREDIENTS"]:
         if word in combined:
-            logging.warning(f"🚫 Förbjuden ingrediens i '{middag.get('titel')}': {word}")
+            log.warning(f"🚫 Förbjuden ingrediens i '{middag.get('titel')}': {word}")
             return False
     return True
 
 
 def generate_dinner_for_day(vecka: int, dagNamn: str) -> dict:
-    logging.info(f"🔁 Genererar ny middag för {dagNamn} i vecka {vecka}...")
+    import uuid
+    _init()
+    log.info(f"🔁 Genererar ny middag för {dagNamn} i vecka {vecka}...")
     print("🤖 Börjar generera mat för enskild dag...")
 
-    recent_dinners = fetch_recent_dinners()
-    liked_meals = fetch_liked_meals()
+    context = gather_context(include_lunches=False)
+    recent_dinners = context["recent_dinners"]
+    liked_meals = context["liked_meals"]
     seed = str(uuid.uuid4())[:8]
 
     prompt = f"""
@@ -447,7 +593,7 @@ Du är en svensk matinspiratör som ska föreslå EN ny middag för en barnfamil
 
 ⚠️ VIKTIGT:
 En familjemedlem har livshotande allergi mot:
-{', '.join(FORBIDDEN_INGREDIENTS)}
+{', '.join(get_config()['FORBIDDEN_INGREDIENTS'])}
 Föreslå aldrig något som innehåller någon av ovan ingredienser (risk för anafylaktisk chock).
 
 - Dagen är {dagNamn}, vecka {vecka}
@@ -477,8 +623,8 @@ Returnera ENDAST giltig JSON i följande format:
     middag = None
     last_error = None
     for attempt in range(3):
-        logging.info(f"🌀 Försök {attempt + 1} (seed={seed})")
-        completion = openai.chat.completions.create(
+        log.info(f"🌀 Försök {attempt + 1} (seed={seed})")
+        completion = get_openai().chat.completions.create(
             model=OPENAI_MODEL,
             messages=[{"role": "user", "content": prompt}],
             temperature=OPENAI_TEMPERATURE
@@ -490,12 +636,12 @@ Returnera ENDAST giltig JSON i följande format:
         cost_usd = (pt/1000.0)*INPUT_PRICE + (ct/1000.0)*OUTPUT_PRICE
         cost_sek = cost_usd * USD_TO_SEK
 
-        logging.info(
+        log.info(
            f"💰Byte av en middag: Tokens prompt={pt}, completion={ct}, total={pt+ct}. "
            f"Cost ≈ ${cost_usd:.4f} (~{cost_sek:.2f} SEK)"
         )
         print(f"[COST] prompt={pt}, completion={ct}, total={pt+ct}, ~${cost_usd:.4f} (~{cost_sek:.2f} SEK)")
-        logging.info("🔤 GPT-svar (enkild middag):\n%s", raw)
+        log.info("🔤 GPT-svar (enkild middag):\n%s", raw)
         try:
             parsed = json.loads(raw)
             if "middag" in parsed:
@@ -519,14 +665,14 @@ Returnera ENDAST giltig JSON i följande format:
         raise Exception(f"🚨 Kunde inte generera säker middag efter 3 försök. Orsak: {last_error or 'okänd'}")
 
     # Uppdatera mealplan
-    data = supabase.table("mealplan").select("id", "data").eq("vecka", vecka).limit(1).execute()
+    data = get_supabase().table("mealplan").select("id", "data").eq("vecka", vecka).limit(1).execute()
     if not data.data:
         raise Exception("Kunde inte hitta befintlig mealplan.")
     plan = data.data[0]["data"]
     for dag in plan.get("dagar", []):
         if dag.get("dag") == dagNamn:
             dag["middag"] = middag
-    supabase.table("mealplan").update({"data": plan}).eq("vecka", vecka).execute()
+    get_supabase().table("mealplan").update({"data": plan}).eq("vecka", vecka).execute()
 
     # Regenerera shoppinglista
     shopping_items = build_shopping_items(plan, vecka)
@@ -539,15 +685,16 @@ Returnera ENDAST giltig JSON i följande format:
 # ------------------------------
 def run():
     print("▶️ run() körs")
+    _init()
     try:
         week = get_current_week()
         print("📅 Vecka som planeras:", week)
-        matsedel = generate_meal_plan()
+        context = gather_context()
+        matsedel = generate_meal_plan(context)
         matsedel["vecka"] = week
 
-        # Sista säkerhetsnät: fyll i luncher på vardagar om de saknas
-        school_lunches = fetch_school_lunches()
-        matsedel = _ensure_weekday_lunches(matsedel, school_lunches)
+        # Sista säkerhetsnät: fyll i luncher på vardagar om de saknas (samma skolmat som i prompten)
+        matsedel = _ensure_weekday_lunches(matsedel, context["school_lunches"])
 
         save_matsedel_local(matsedel)
 
@@ -558,7 +705,7 @@ def run():
         log_status(True, "AI-agenten skapade veckans matsedel")
     except Exception as e:
         print("❌ Fel i run():", str(e))
-        logging.error(f"Fel i run(): {e}")
+        log.error(f"Fel i run(): {e}")
         log_status(False, f"Fel: {str(e)}")
 
 if __name__ == "__main__":
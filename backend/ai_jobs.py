@@ -0,0 +1,202 @@
+# backend/ai_jobs.py
+"""
+Jobbkö för AI-planeringen, delad av alla gunicorn-workers.
+
+POST /api/planera lägger bara in ett jobb här och svarar direkt; en
+bakgrundstråd i någon worker plockar jobbet (claim) och kör planeringen.
+SQLite-filen under DATA_DIR gör att status kan läsas via /api/ai-status
+oavsett vilken worker som tar emot anropet, och att samma vecka inte kan
+köas två gånger (dedup_key). Antalet samtidigt körande jobb begränsas
+över alla workers i claim().
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    dedup_key   TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    progress    TEXT,
+    message     TEXT,
+    result      TEXT,
+    owner       TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_active ON jobs (dedup_key, status);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created_at)
+"""
+
+# Status: queued → running → done | failed
+ACTIVE = ("queued", "running")
+
+_COLUMNS = ("id", "kind", "dedup_key", "status", "progress", "message", "result",
+            "owner", "created_at", "started_at", "finished_at", "updated_at")
+
+
+def _owner_id() -> str:
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def _row_to_job(row) -> Dict:
+    job = dict(zip(_COLUMNS, row))
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+class JobStore:
+    """Liten SQLite-wrapper med samma anslutningsmönster som SharedEventStore."""
+
+    def __init__(self, path: Path, keep_days: float = 7.0) -> None:
+        self.path = Path(path)
+        self.keep_seconds = keep_days * 86400
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+
+    # -------------------- intern --------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_schema(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current != SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS jobs")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            for stmt in _SCHEMA.strip().split(";"):
+                if stmt.strip():
+                    conn.execute(stmt)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _select(self, conn: sqlite3.Connection, where: str, args: Tuple) -> Optional[Dict]:
+        row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE {where}", args).fetchone()
+        return _row_to_job(row) if row else None
+
+    # -------------------- API --------------------
+
+    def submit(self, kind: str, dedup_key: str) -> Tuple[Dict, bool]:
+        """
+        Köa ett jobb. Finns redan ett köat/körande jobb med samma dedup_key
+        returneras det i stället: (jobb, False). Annars (nytt jobb, True).
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            existing = self._select(
+                conn, "dedup_key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1", (dedup_key, *ACTIVE)
+            )
+            if existing:
+                conn.execute("COMMIT")
+                return existing, False
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, dedup_key, status, progress, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', 'I kö', ?, ?)",
+                (job_id, kind, dedup_key, now, now),
+            )
+            job = self._select(conn, "id = ?", (job_id,))
+            conn.execute("COMMIT")
+            return job, True
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            return self._select(conn, "id = ?", (job_id,))
+        finally:
+            conn.close()
+
+    def claim(self, max_running: int, stale_after: float) -> Optional[Dict]:
+        """
+        Ta äldsta köade jobbet om färre än max_running körs (räknat över alla
+        workers). Körande jobb äldre än stale_after sekunder räknas som döda
+        (t.ex. worker som startats om) och markeras som misslyckade.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, updated_at = ?, "
+                "message = 'Jobbet avbröts (ingen worker kör det längre)' "
+                "WHERE status = 'running' AND started_at < ?",
+                (now, now, now - stale_after),
+            )
+            conn.execute("DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated_at < ?",
+                         (*ACTIVE, now - self.keep_seconds))
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+            job = None
+            if running < max_running:
+                job = self._select(conn, "status = 'queued' ORDER BY created_at LIMIT 1", ())
+                if job:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', owner = ?, started_at = ?, updated_at = ?, "
+                        "progress = 'Startar' WHERE id = ?",
+                        (_owner_id(), now, now, job["id"]),
+                    )
+                    job = self._select(conn, "id = ?", (job["id"],))
+            conn.execute("COMMIT")
+            return job
+        finally:
+            conn.close()
+
+    def fail_orphans(self, pid: int) -> int:
+        """
+        Markera körande jobb som ägs av en annan process än pid som
+        misslyckade. Anropas av den worker som just tagit över jobbkön: en
+        tidigare ägare har då dött, så dess jobb kör inte längre och ska
+        varken blockera kön eller ta emot dedup:ade anrop. Returnerar antalet.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, updated_at = ?, "
+                "message = 'Jobbet avbröts (ingen worker kör det längre)' "
+                "WHERE status = 'running' AND (owner IS NULL OR owner NOT LIKE ?)",
+                (now, now, f"{pid}:%"),
+            )
+            return cur.rowcount
+        finally:
+            conn.close()
+
+    def progress(self, job_id: str, text: str) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?", (text, time.time(), job_id))
+        finally:
+            conn.close()
+
+    def finish(self, job_id: str, ok: bool, message: str, result: Optional[Dict] = None) -> None:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, result = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+                ("done" if ok else "failed", message,
+                 json.dumps(result, ensure_ascii=False) if result is not None else None, now, now, job_id),
+            )
+        finally:
+            conn.close()
@@ -0,0 +1,165 @@
+# backend/bench_startup.py
+"""
+Mäter hur lång tid en worker tar att boota: import av planera_api och första
+svar från /api/health, i en ny Python-process per körning (som en gunicorn-worker).
+
+  python bench_startup.py              # med nätverk
+  python bench_startup.py --offline    # nätverket "svart hål" via proxy
+  python bench_startup.py --both -n 5  # jämför båda
+  python bench_startup.py --ai-only    # bara importbudgeten för ai_agent
+
+--offline pekar HTTP(S)_PROXY mot en icke-routbar adress, så att varje
+utgående anrop hänger tills sin timeout i stället för att faila direkt –
+precis som en boot utan nät. Startar appen utan att vänta på nätverket ska
+båda lägena ge ungefär samma tid.
+
+Importen av ai_agent (lazy i /api/byt-middag) kontrolleras alltid mot en
+budget: tiden utöver stdlib-moduler som API:t ändå har laddat (_API_PRELOADED
+importeras före mätningen), inga utskrifter, orörd root-logger och inga tunga
+klientbibliotek inlästa. Scriptet avslutas med felkod om budgeten överskrids,
+så det kan användas som regressionsvakt.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+# Icke-routbar adress: anslutningar hänger i stället för att nekas
+BLACKHOLE_PROXY = "http://10.255.255.1:9"
+
+_PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import planera_api
+t1 = time.perf_counter()
+r = planera_api.app.test_client().get("/api/health")
+t2 = time.perf_counter()
+print(json.dumps({"import_s": t1 - t0, "health_s": t2 - t1, "status": r.status_code}))
+"""
+
+# Moduler som ai_agent inte får dra in vid import (ska laddas lazy)
+AI_HEAVY_MODULES = ("requests", "openai", "supabase", "dotenv", "uuid")
+
+# Stdlib som planera_api (och dess egna moduler) redan har laddat när
+# /api/byt-middag gör den lazy importen – de ska inte räknas mot ai_agent.
+# pathlib drar t.ex. in urllib.parse och ipaddress (flera ms).
+_API_PRELOADED = (
+    "os", "sys", "re", "io", "json", "time", "hashlib", "heapq", "queue", "threading",
+    "logging", "datetime", "collections", "contextlib", "pathlib", "typing",
+    "concurrent.futures", "sqlite3", "zlib",
+)
+
+_AI_PROBE = r"""
+import importlib, io, json, logging, sys, time
+from contextlib import redirect_stdout
+for m in %r:
+    importlib.import_module(m)
+root_handlers = list(logging.root.handlers)
+out = io.StringIO()
+t0 = time.perf_counter()
+with redirect_stdout(out):
+    import ai_agent
+t1 = time.perf_counter()
+print(json.dumps({
+    "import_s": t1 - t0,
+    "stdout": out.getvalue(),
+    "root_logging_changed": logging.root.handlers != root_handlers,
+    "heavy": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def run_once(offline: bool, timeout: float) -> dict:
+    env = dict(os.environ)
+    if offline:
+        for k in ("HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy"):
+            env[k] = BLACKHOLE_PROXY
+        env.pop("NO_PROXY", None)
+        env.pop("no_proxy", None)
+    try:
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE], cwd=str(HERE), env=env,
+            capture_output=True, text=True, timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return {"import_s": None, "health_s": None, "status": f"timeout > {timeout:.0f}s"}
+    if out.returncode != 0:
+        return {"import_s": None, "health_s": None, "status": f"fel: {out.stderr.strip().splitlines()[-1:]}"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def ai_import_once(timeout: float) -> dict:
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # mät med .pyc, som i drift
+    out = subprocess.run(
+        [sys.executable, "-c", _AI_PROBE % (_API_PRELOADED, AI_HEAVY_MODULES)], cwd=str(HERE), env=env,
+        capture_output=True, text=True, timeout=timeout,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"import ai_agent misslyckades: {out.stderr.strip().splitlines()[-1:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def check_ai_import(runs: int, budget_ms: float, timeout: float) -> bool:
+    """Median av importtiden för ai_agent mot budget + kontroll av sidoeffekter."""
+    try:
+        ai_import_once(timeout)  # uppvärmning: skriver .pyc
+        results = [ai_import_once(timeout) for _ in range(runs)]
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        print(f"ai_agent misslyckades: {e}")
+        return False
+    imp_ms = statistics.median(r["import_s"] for r in results) * 1000
+    problems = []
+    if imp_ms > budget_ms:
+        problems.append(f"över budget {budget_ms:.1f} ms")
+    if any(r["stdout"] for r in results):
+        problems.append(f"skriver vid import: {results[0]['stdout'][:80]!r}")
+    if any(r["root_logging_changed"] for r in results):
+        problems.append("ändrar root-loggern")
+    heavy = sorted({m for r in results for m in r["heavy"]})
+    if heavy:
+        problems.append(f"importerar {', '.join(heavy)}")
+    print(f"ai_agent import {imp_ms:8.1f} ms   (median av {runs}, budget {budget_ms:.1f} ms)   "
+          + ("OK" if not problems else "FEL: " + "; ".join(problems)))
+    return not problems
+
+
+def bench(label: str, offline: bool, runs: int, timeout: float) -> None:
+    results = [run_once(offline, timeout) for _ in range(runs)]
+    ok = [r for r in results if r["import_s"] is not None]
+    if not ok:
+        print(f"{label:8s} misslyckades: {results[0]['status']}")
+        return
+    imp = statistics.median(r["import_s"] for r in ok)
+    health = statistics.median(r["health_s"] for r in ok)
+    print(f"{label:8s} import {imp * 1000:8.1f} ms   första /api/health {health * 1000:7.1f} ms   "
+          f"(median av {len(ok)}/{runs}, status {ok[0]['status']})")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Mät worker-boot (import + första /api/health)")
+    ap.add_argument("--offline", action="store_true", help="simulera boot utan nätverk")
+    ap.add_argument("--both", action="store_true", help="kör både med och utan nätverk")
+    ap.add_argument("-n", "--runs", type=int, default=3, help="antal körningar per läge")
+    ap.add_argument("--timeout", type=float, default=120.0, help="max sekunder per körning")
+    ap.add_argument("--ai-budget-ms", type=float, default=4.0,
+                    help="max importtid för ai_agent (median ca 2–2,5 ms)")
+    ap.add_argument("--ai-only", action="store_true", help="kontrollera bara ai_agent-importen")
+    args = ap.parse_args()
+
+    if not args.ai_only:
+        if args.both or not args.offline:
+            bench("online", False, args.runs, args.timeout)
+        if args.both or args.offline:
+            bench("offline", True, args.runs, args.timeout)
+    if not check_ai_import(args.runs, args.ai_budget_ms, args.timeout):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# backend/event_index.py
+"""
+Kompakt representation och intervallindex för cachade händelser.
+
+EventRecord är en __slots__-post med tider som epoch-sekunder och internerade
+kalender-/källnamn. Dess JSON kodas en gång när bucketen byggs (encode()), så
+att svar bara behöver foga ihop färdiga fragment (join_fragments()).
+EventIndex byggs en gång per månadsbucket: start/slut ligger i sorterade
+arrayer, så att /api/events kan svara på tidsfönster med binärsökning;
+långa händelser hålls utanför arrayerna så att de inte förlänger sökningen.
+
+BucketCache är en liten trådsäker LRU för memoiserade månadsexpansioner.
+"""
+import json
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, tzinfo
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+# Samma kodning som Flask jsonify (sorterade nycklar, kompakt, ASCII-escape)
+_JSON_OPTS = {"ensure_ascii": True, "sort_keys": True, "separators": (",", ":")}
+
+
+class EventRecord:
+    """
+    En expanderad händelse. start/end är epoch-sekunder (end kan saknas);
+    calendar och source är internerade eftersom de upprepas i varje förekomst.
+    """
+
+    __slots__ = ("uid", "summary", "location", "start", "end", "all_day", "source", "calendar", "fragment")
+
+    def __init__(self, uid: str, summary: str, location: str, start: int, end: Optional[int],
+                 all_day: bool, source: str, calendar: str) -> None:
+        self.uid = uid
+        self.summary = summary
+        self.location = location
+        self.start = start
+        self.end = end
+        self.all_day = all_day
+        self.source = sys.intern(source)
+        self.calendar = sys.intern(calendar)
+        self.fragment = b""
+
+    def to_dict(self, tz: tzinfo) -> Dict:
+        """JSON-formen som /api/events alltid haft (ISO8601 i given tidszon)."""
+        return {
+            "id": self.uid,
+            "summary": self.summary,
+            "location": self.location,
+            "start": datetime.fromtimestamp(self.start, tz).isoformat(),
+            "end": (datetime.fromtimestamp(self.end, tz).isoformat() if self.end is not None else None),
+            "allDay": self.all_day,
+            "source": self.source,
+            "calendar": self.calendar,
+        }
+
+    def encode(self, tz: tzinfo) -> "EventRecord":
+        """Koda postens JSON en gång; återanvänds i varje svar som innehåller den."""
+        self.fragment = json.dumps(self.to_dict(tz), **_JSON_OPTS).encode("ascii")
+        return self
+
+
+def join_fragments(records: Iterable[EventRecord]) -> bytes:
+    """JSON-array av förkodade poster, byte-identisk med jsonify([...to_dict()])."""
+    return b"[" + b",".join(r.fragment for r in records) + b"]\n"
+
+
+# Händelser längre än så här indexeras separat (se EventIndex)
+LONG_EVENT_S = 2 * 86400
+
+
+class EventIndex:
+    """
+    Poster sorterade på start. Korta händelser (≤ LONG_EVENT_S) ligger i
+    parallella arrayer:
+      starts[j]  – start (epoch)
+      ends[j]    – slut (epoch); saknat/noll-längd slut räknas som start + 1 s
+      max_end[j] – max(ends[0..j]), växande → binärsökbar nedre gräns
+      pos[j]     – index i events
+    Långa händelser (t.ex. flerveckors lov) ligger i en egen lista som gås
+    igenom linjärt. Annars skulle en enda lång händelse tidigt i indexet hålla
+    max_end uppe och tvinga varje sökning att skanna tillbaka till den.
+
+    between() returnerar alla poster som överlappar [t_min, t_max), även
+    flerdagarshändelser som började före t_min, i start-ordning. Kostnad
+    O(log n + k + s + L): k träffar, s korta händelser som startar inom
+    LONG_EVENT_S före t_min men redan slutat, L antal långa händelser.
+    """
+
+    __slots__ = ("events", "starts", "ends", "max_end", "pos", "long")
+
+    def __init__(self, events: List[EventRecord]) -> None:
+        # stabil sortering → behåller merge-ordningen vid lika start
+        self.events: List[EventRecord] = sorted(events, key=lambda e: e.start)
+        self.starts = array("q")
+        self.ends = array("q")
+        self.max_end = array("q")
+        self.pos = array("q")
+        self.long: List[tuple] = []  # (start, slut, index i events)
+        running = None
+        for i, e in enumerate(self.events):
+            end = max(e.end or e.start, e.start + 1)
+            if end - e.start > LONG_EVENT_S:
+                self.long.append((e.start, end, i))
+                continue
+            self.starts.append(e.start)
+            self.ends.append(end)
+            self.pos.append(i)
+            running = end if running is None or end > running else running
+            self.max_end.append(running)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def between(self, t_min: int, t_max: int) -> List[EventRecord]:
+        hi = bisect_left(self.starts, t_max)        # start < t_max
+        lo = bisect_right(self.max_end, t_min, 0, hi)  # första som kan sluta efter t_min
+        ends, pos = self.ends, self.pos
+        hits = [pos[j] for j in range(lo, hi) if ends[j] > t_min]
+        long_hits = [i for start, end, i in self.long if start < t_max and end > t_min]
+        if long_hits:
+            hits = sorted(hits + long_hits)  # tillbaka till start-ordning (stabil)
+        return [self.events[i] for i in hits]
+
+
+class BucketCache:
+    """LRU med fast maxantal poster; äldst använda släpps först."""
+
+    def __init__(self, max_items: int) -> None:
+        self.max_items = max(1, max_items)
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,270 @@
+# backend/events_store.py
+"""
+Delad händelsecache för alla gunicorn-workers.
+
+SQLite-filen under DATA_DIR håller, per ICS-källa, senast lyckade råa ICS-kropp
+med egen version, ETag/Last-Modified/innehållshash för villkorliga hämtningar
+och backoff-status. Bara en worker i taget hämtar källorna (refresh-låset);
+den publicerar sedan vilka källversioner som gäller i snapshot-raden. Varje
+worker parsar en källa en gång per version och expanderar månader vid behov.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+SCHEMA_VERSION = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot (
+    id          INTEGER PRIMARY KEY CHECK (id = 1),
+    version     INTEGER NOT NULL,
+    built_at    REAL    NOT NULL,
+    expires_at  REAL    NOT NULL,
+    sources_sig TEXT    NOT NULL
+);
+CREATE TABLE IF NOT EXISTS source_state (
+    url         TEXT PRIMARY KEY,
+    version     INTEGER NOT NULL DEFAULT 0,
+    fails       INTEGER NOT NULL DEFAULT 0,
+    retry_at    REAL    NOT NULL DEFAULT 0,
+    fetched_at  REAL,
+    body        BLOB,
+    etag        TEXT,
+    last_modified TEXT,
+    body_hash   TEXT
+);
+CREATE TABLE IF NOT EXISTS refresh_lock (
+    id     INTEGER PRIMARY KEY CHECK (id = 1),
+    owner  TEXT NOT NULL,
+    until  REAL NOT NULL
+);
+"""
+
+
+def _owner_id() -> str:
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+class SharedEventStore:
+    """
+    Liten SQLite-wrapper: en snapshot-rad (version + utgångstid + källversioner),
+    en rad per källa och en låsrad med utgångstid, så att ett kraschat lås inte
+    blir hängande.
+    """
+
+    def __init__(self, path: Path, lock_ttl: float = 120.0) -> None:
+        self.path = Path(path)
+        self.lock_ttl = lock_ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_schema()
+
+    # -------------------- intern --------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        # Ny anslutning per anrop: billigt för SQLite och säkert över fork/trådar.
+        conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_schema(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current != SCHEMA_VERSION:
+                # Cachefil från äldre version → börja om, innehållet går att återskapa
+                tables = [r[0] for r in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+                )]
+                for t in tables:
+                    conn.execute(f'DROP TABLE IF EXISTS "{t}"')
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            for stmt in _SCHEMA.strip().split(";"):
+                if stmt.strip():
+                    conn.execute(stmt)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    # -------------------- snapshot --------------------
+
+    def meta(self) -> Optional[Tuple[int, float, float, List[Tuple[str, int]]]]:
+        """
+        (version, built_at, expires_at, [(url, källversion), ...]) eller None.
+        built_at är den äldsta lyckade hämtningen bland publicerade källor, dvs.
+        hur gammal datan är – inte när refresh senast försöktes.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT version, built_at, expires_at, sources_sig FROM snapshot WHERE id = 1"
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        sources = [(str(u), int(v)) for u, v in json.loads(row[3])]
+        return int(row[0]), float(row[1]), float(row[2]), sources
+
+    def publish(self, sources: List[Tuple[str, int]], ttl_seconds: float) -> int:
+        """
+        Publicera vilka källversioner som gäller och returnera snapshot-versionen.
+        Versionen räknas bara upp om någon källa ändrats; annars förlängs bara TTL.
+        built_at sätts till äldsta lyckade hämtning (fetched_at) bland källorna,
+        så att en refresh där alla källor fallerade inte ser färsk ut.
+        """
+        now = time.time()
+        sig = json.dumps([[u, v] for u, v in sources], separators=(",", ":"))
+        urls = [u for u, v in sources if v]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT version, sources_sig, built_at FROM snapshot WHERE id = 1").fetchone()
+            if row and row[1] == sig:
+                version = int(row[0])
+            else:
+                version = (int(row[0]) + 1) if row else 1
+            oldest = None
+            if urls:
+                oldest = conn.execute(
+                    f"SELECT MIN(fetched_at) FROM source_state WHERE url IN ({','.join('?' * len(urls))}) "
+                    "AND fetched_at IS NOT NULL",
+                    urls,
+                ).fetchone()[0]
+            if oldest is None:
+                oldest = float(row[2]) if row else now
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshot (id, version, built_at, expires_at, sources_sig) "
+                "VALUES (1, ?, ?, ?, ?)",
+                (version, float(oldest), now + ttl_seconds, sig),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return version
+
+    def postpone(self, seconds: float) -> None:
+        """Skjut upp utgångstiden (t.ex. efter misslyckad refresh) utan att byta version."""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE snapshot SET expires_at = ? WHERE id = 1", (time.time() + seconds,))
+        finally:
+            conn.close()
+
+    # -------------------- per källa --------------------
+
+    def source_states(self) -> Dict[str, Dict]:
+        """
+        url → {version, fails, retry_at, fetched_at, etag, last_modified, body_hash}.
+        version 0 betyder att källan aldrig lyckats; kroppen hämtas med source_body().
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT url, version, fails, retry_at, fetched_at, etag, last_modified, body_hash "
+                "FROM source_state"
+            ).fetchall()
+        finally:
+            conn.close()
+        return {
+            row[0]: {
+                "version": int(row[1]),
+                "fails": int(row[2]),
+                "retry_at": float(row[3]),
+                "fetched_at": row[4],
+                "etag": row[5],
+                "last_modified": row[6],
+                "body_hash": row[7],
+            }
+            for row in rows
+        }
+
+    def source_body(self, url: str) -> Tuple[int, Optional[bytes]]:
+        """(version, senast lyckade ICS-kropp) för en källa; (0, None) om inget finns."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT version, body FROM source_state WHERE url = ?", (url,)).fetchone()
+        finally:
+            conn.close()
+        if not row or row[1] is None:
+            return 0, None
+        return int(row[0]), bytes(row[1])
+
+    def source_ok(self, url: str, body: Optional[bytes], etag: Optional[str] = None,
+                  last_modified: Optional[str] = None, body_hash: Optional[str] = None) -> int:
+        """
+        Markera lyckad hämtning och returnera källans version. body=None betyder
+        oförändrad källa (304 eller samma hash): behåll kropp och version.
+        Annars sparas ny kropp och versionen räknas upp.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if body is None:
+                conn.execute(
+                    "UPDATE source_state SET fails = 0, retry_at = 0, fetched_at = ?, "
+                    "etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                    (now, etag, last_modified, url),
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO source_state "
+                    "(url, version, fails, retry_at, fetched_at, body, etag, last_modified, body_hash) "
+                    "VALUES (?, 1, 0, 0, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(url) DO UPDATE SET version = version + 1, fails = 0, retry_at = 0, "
+                    "fetched_at = excluded.fetched_at, body = excluded.body, etag = excluded.etag, "
+                    "last_modified = excluded.last_modified, body_hash = excluded.body_hash",
+                    (url, now, sqlite3.Binary(body), etag, last_modified, body_hash),
+                )
+            row = conn.execute("SELECT version FROM source_state WHERE url = ?", (url,)).fetchone()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return int(row[0]) if row else 0
+
+    def source_failed(self, url: str, fails: int, retry_at: float) -> None:
+        """Räkna upp fel och sätt nästa försök; senast lyckade kropp ligger kvar."""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO source_state (url, fails, retry_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET fails = excluded.fails, retry_at = excluded.retry_at",
+                (url, fails, retry_at),
+            )
+        finally:
+            conn.close()
+
+    # -------------------- refresh-lås --------------------
+
+    def try_lock(self) -> bool:
+        """Försök ta refresh-låset. Returnerar False om en annan worker redan håller det."""
+        now = time.time()
+        me = _owner_id()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner, until FROM refresh_lock WHERE id = 1").fetchone()
+            if row and row[0] != me and float(row[1]) > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO refresh_lock (id, owner, until) VALUES (1, ?, ?)",
+                (me, now + self.lock_ttl),
+            )
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+
+    def release(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM refresh_lock WHERE id = 1 AND owner = ?", (_owner_id(),))
+        finally:
+            conn.close()
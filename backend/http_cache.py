@@ -0,0 +1,66 @@
+# backend/http_cache.py
+"""
+Villkorliga svar (If-None-Match → 304) och gzip som komprimeras en gång.
+
+CachedBody håller en färdig svarskropp med stark ETag. gzip-varianten skapas
+första gången en klient ber om den och återanvänds sedan så länge kroppen
+ligger kvar i anroparens cache. conditional_response() väljer variant efter
+Accept-Encoding; varianterna har olika ETag eftersom de är olika byte.
+"""
+import gzip
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from flask import Response, request
+
+# Mindre kroppar skickas okomprimerade (gzip-headern äter upp vinsten)
+GZIP_MIN_BYTES = 1024
+
+
+class CachedBody:
+    """Svarskropp + stark ETag (utan citattecken) + lazy gzip-variant."""
+
+    __slots__ = ("body", "etag", "_gz", "_lock")
+
+    def __init__(self, body: bytes, tag: Optional[str] = None) -> None:
+        self.body = body
+        self.etag = tag or hashlib.sha1(body).hexdigest()
+        self._gz: Optional[bytes] = None
+        self._lock = threading.Lock()
+
+    def gzipped(self) -> bytes:
+        if self._gz is None:
+            with self._lock:
+                if self._gz is None:
+                    # mtime=0 → samma byte varje gång, så ETag-varianten är stabil
+                    self._gz = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gz
+
+
+def make_tag(*parts) -> str:
+    """Kort stabil ETag ur cachenyckelns delar (version, fönster, ...)."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:24]
+
+
+def conditional_response(cached: CachedBody, mimetype: str,
+                         headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    200 med (ev. gzip:ad) kropp, eller 304 utan kropp om klientens
+    If-None-Match redan matchar vald variant.
+    """
+    use_gzip = len(cached.body) >= GZIP_MIN_BYTES and request.accept_encodings.quality("gzip") > 0
+    etag = cached.etag + "-gz" if use_gzip else cached.etag
+
+    hdrs = dict(headers or {})
+    hdrs["ETag"] = f'"{etag}"'
+    hdrs["Vary"] = "Accept-Encoding"
+
+    if request.if_none_match.contains_weak(etag):
+        hdrs.pop("Content-Disposition", None)
+        return Response(status=304, headers=hdrs)
+
+    if use_gzip:
+        hdrs["Content-Encoding"] = "gzip"
+        return Response(cached.gzipped(), mimetype=mimetype, headers=hdrs)
+    return Response(cached.body, mimetype=mimetype, headers=hdrs)
@@ -2,9 +2,14 @@ import os
 import sys
 import re
 import json
-import subprocess
+import time
+import hashlib
+import heapq
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 
 import requests
 import datetime as dt
@@ -23,7 +28,20 @@ from icalendar import Calendar
 import recurring_ical_events
 from dateutil.tz import gettz
 
-from skola24_ics_blueprint import skola24_bp
+# .env måste vara laddad innan blueprinten läser sin konfiguration vid import
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:  # python-dotenv är valfritt
+    pass
+
+from skola24_ics_blueprint import skola24_bp, lessons_for_classes, SCHOOL_NAME
+from events_store import SharedEventStore
+from event_index import EventIndex, EventRecord, BucketCache, join_fragments
+from http_cache import CachedBody, conditional_response
+from singleflight import SingleFlight
+from ai_jobs import JobStore
+from planner_worker import PlannerProcess
 
 
 # -------------------- App & Config --------------------
@@ -34,7 +52,8 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 app = Flask(__name__)
 if CORS:
-    CORS(app, resources={r"/api/*": {"origins": os.getenv("CORS_ORIGIN", "*")}})
+    CORS(app, resources={r"/api/*": {"origins": os.getenv("CORS_ORIGIN", "*")}},
+         expose_headers=["X-Cache-Age", "X-Range-Truncated"])
 
 TZ = gettz("Europe/Stockholm")
 app.register_blueprint(skola24_bp, url_prefix="/api/skola24")
@@ -137,12 +156,48 @@ def mealplan_get():
     rows = r.json() if r.text else []
     return jsonify({"status":"ok","vecka": int(vecka),"data": (rows[0]["data"] if rows else None)})
 
-# Cache-inställningar (enkelt minnescache)
+# Cache-inställningar: råa ICS-kroppar delas mellan workers via SQLite under DATA_DIR.
+# Varje worker parsar en källa en gång per version och expanderar månader vid behov.
 CACHE_TTL = dt.timedelta(minutes=int(os.getenv("CACHE_TTL_MINUTES", "5")))
-_cache_until: Optional[dt.datetime] = None
-_cache_events: List[Dict] = []
-
-# Fönster för vilka events vi expanderar i cachen
+EVENTS_CACHE_PATH = Path(os.getenv("EVENTS_CACHE_PATH", str(DATA_DIR / "events_cache.sqlite3")))
+# Hur länge en worker väntar på att en annan ska bygga den allra första snapshoten
+EVENTS_COLD_WAIT_S = float(os.getenv("EVENTS_COLD_WAIT_S", "30"))
+# Bakgrundsrefresh: starta så här långt före utgång, och kolla så här ofta
+EVENTS_REFRESH_AHEAD_S = float(os.getenv("EVENTS_REFRESH_AHEAD_S", "60"))
+EVENTS_REFRESH_CHECK_S = float(os.getenv("EVENTS_REFRESH_CHECK_S", "15"))
+# Anrop läser den delade snapshot-raden högst så här ofta per worker; däremellan
+# används den lokala kopian (en annan workers nya version syns med den fördröjningen)
+EVENTS_META_CHECK_S = float(os.getenv("EVENTS_META_CHECK_S", "1"))
+# Parallell hämtning av ICS_URLS: max antal samtidiga hämtningar och total deadline
+ICS_FETCH_WORKERS = int(os.getenv("ICS_FETCH_WORKERS", "4"))
+ICS_FETCH_DEADLINE_S = float(os.getenv("ICS_FETCH_DEADLINE_S", "25"))
+# Backoff per källa som fortsätter fallera (exponentiell, med tak)
+ICS_BACKOFF_BASE_S = float(os.getenv("ICS_BACKOFF_BASE_S", "60"))
+ICS_BACKOFF_MAX_S = float(os.getenv("ICS_BACKOFF_MAX_S", "3600"))
+# Memoiserade månadsexpansioner per worker (LRU), och max antal månader per anrop
+ICS_MONTH_BUCKETS_MAX = int(os.getenv("ICS_MONTH_BUCKETS_MAX", "96"))
+ICS_MAX_QUERY_MONTHS = int(os.getenv("ICS_MAX_QUERY_MONTHS", "60"))
+# Färdiga svarskroppar (med ETag och gzip-variant) per (källversioner, fönster);
+# standardfönstret avrundas till EVENTS_WINDOW_STEP_S så att upprepade
+# pollningar träffar samma kropp – och oftast blir 304
+EVENTS_BODY_CACHE_MAX = int(os.getenv("EVENTS_BODY_CACHE_MAX", "32"))
+EVENTS_WINDOW_STEP_S = int(os.getenv("EVENTS_WINDOW_STEP_S", "300"))
+_store = SharedEventStore(EVENTS_CACHE_PATH)
+_cache_lock = threading.Lock()
+_cache_version: Optional[int] = None
+_cache_built_at: float = 0.0
+_cache_expires_at: float = 0.0
+_cache_sources: List[Tuple[str, int]] = []
+_meta_read_at: float = float("-inf")  # time.monotonic() vid senaste _sync_local
+# url → (källversion, (kalendernamn, källtyp, recurring_ical_events-fråga) eller None)
+_parsed: Dict[str, Tuple[int, Optional[Tuple]]] = {}
+# (url, källversion, månad) → sorterad lista; (källversioner, månad) → EventIndex
+_source_months = BucketCache(ICS_MONTH_BUCKETS_MAX)
+_merged_months = BucketCache(ICS_MONTH_BUCKETS_MAX)
+_expand_lock = threading.Lock()
+_bodies = BucketCache(EVENTS_BODY_CACHE_MAX)
+
+# Fönster vars månader förvärms i bakgrunden efter varje ny version
 ICS_WINDOW_PAST_DAYS = int(os.getenv("ICS_WINDOW_PAST_DAYS", "30"))
 ICS_WINDOW_FUTURE_DAYS = int(os.getenv("ICS_WINDOW_FUTURE_DAYS", "180"))
 
@@ -165,33 +220,67 @@ def _parse_time_param(val: Optional[str], default: datetime) -> datetime:
         v = v[:-1] + '+00:00'
     return datetime.fromisoformat(v)
 
-def _to_iso(x):
+def _to_epoch(x) -> int:
     """
-    ISO8601 i Europe/Stockholm:
-    - Heldag: 00:00 lokal tid den dagen (med korrekt offset).
-    - Datetime: konverteras till Europe/Stockholm; naiva tider antas vara lokal tid.
+    Epoch-sekunder för en ICS-tid:
+    - Heldag: 00:00 lokal tid (Europe/Stockholm) den dagen.
+    - Datetime: naiva tider antas vara lokal tid.
     """
     if hasattr(x, "hour"):  # datetime
         if x.tzinfo is None:
             x = x.replace(tzinfo=TZ)
-        return x.astimezone(TZ).isoformat()
+        return int(x.timestamp())
     else:
         # date → 00:00 lokal tid
-        dt_local = dt.datetime(x.year, x.month, x.day, 0, 0, 0, tzinfo=TZ)
-        return dt_local.isoformat()
+        return int(dt.datetime(x.year, x.month, x.day, 0, 0, 0, tzinfo=TZ).timestamp())
+
+# ICS_URLS-poster "skola24:<klass>" hämtas direkt ur Skola24-blueprintens cache
+SKOLA24_SOURCE_PREFIX = "skola24:"
+
+def _parse_source(url: str, body: bytes) -> Tuple[str, str, object]:
+    if url.startswith(SKOLA24_SOURCE_PREFIX):
+        return _parse_lessons(body)
+    return _parse_calendar(body)
 
-def _expand_ics(ics_bytes: bytes, win_start: dt.datetime, win_end: dt.datetime) -> List[Dict]:
+def _parse_lessons(body: bytes) -> Tuple[str, str, object]:
     """
-    Läser en ICS och expanderar återkommande händelser inom [win_start, win_end).
+    Lektions-JSON från Skola24-adaptern: (kalendernamn, 'skola24', lista av
+    (start, slut, id, summary, plats) i epoch-sekunder, sorterad på start).
+    """
+    data = json.loads(body)
+    rows = sorted(
+        (_to_epoch(datetime.fromisoformat(li["start"])), _to_epoch(datetime.fromisoformat(li["end"])),
+         li["id"], li["summary"], li.get("room") or "")
+        for li in data["lessons"]
+    )
+    return data["calendar"], 'skola24', rows
+
+def _parse_calendar(ics_bytes: bytes) -> Tuple[str, str, object]:
+    """
+    Parsar en ICS en gång: (kalendernamn, källtyp, recurring_ical_events-fråga).
+    Reglerna expanderas först när en månad efterfrågas.
     """
     cal = Calendar.from_ical(ics_bytes)
     cal_name = str(cal.get('X-WR-CALNAME') or 'ICS')
     prodid = str(cal.get('prodid') or '').lower()
     src = 'skola24' if 'skola24' in (prodid + cal_name.lower()) else 'ics'
+    return cal_name, src, recurring_ical_events.of(cal)
 
-    items = recurring_ical_events.of(cal).between(win_start, win_end)
-
-    out: List[Dict] = []
+def _expand_parsed(parsed: Tuple, win_start: dt.datetime, win_end: dt.datetime) -> List[EventRecord]:
+    """
+    Expanderar återkommande händelser inom [win_start, win_end) ur en parsad kalender.
+    Texter som upprepas mellan förekomster delar samma str-objekt, och varje
+    post får sin JSON kodad direkt.
+    """
+    cal_name, src, query = parsed
+    if isinstance(query, list):  # Skola24-lektioner, redan i epoch
+        ws, we = int(win_start.timestamp()), int(win_end.timestamp())
+        return [EventRecord(uid, summary, location, start, end, False, src, cal_name).encode(TZ)
+                for start, end, uid, summary, location in query if start < we and end > ws]
+    items = query.between(win_start, win_end)
+
+    pool: Dict[str, str] = {}
+    out: List[EventRecord] = []
     for ev in items:
         start = ev.get('dtstart').dt
         end = (ev.get('dtend').dt if ev.get('dtend') else None)
@@ -200,54 +289,373 @@ def _expand_ics(ics_bytes: bytes, win_start: dt.datetime, win_end: dt.datetime)
         uid = str(ev.get('uid') or '')
         all_day = not hasattr(start, 'hour')
 
-        out.append({
-            "id": uid,
-            "summary": summary,
-            "location": location,
-            "start": _to_iso(start),
-            "end": (_to_iso(end) if end else None),
-            "allDay": all_day,
-            "source": src,
-            "calendar": cal_name,
-        })
+        out.append(EventRecord(
+            pool.setdefault(uid, uid),
+            pool.setdefault(summary, summary),
+            pool.setdefault(location, location),
+            _to_epoch(start),
+            (_to_epoch(end) if end else None),
+            all_day,
+            src,
+            cal_name,
+        ).encode(TZ))
     return out
 
-def _refresh_events() -> List[Dict]:
+def _backoff_s(fails: int) -> float:
+    return min(ICS_BACKOFF_MAX_S, ICS_BACKOFF_BASE_S * (2 ** max(0, fails - 1)))
+
+def _fetch_source(url: str, st: Dict) -> Tuple[Optional[bytes], Dict, Optional[Tuple]]:
+    """
+    Hämtar en källa med villkorlig GET. Returnerar (body, validators, parsed) där
+    body=None betyder oförändrad källa (304 eller samma innehållshash). En ändrad
+    kropp parsas direkt så att trasig ICS räknas som fel på källan. Kastar vid fel.
+    """
+    # Tillåt self-signed på din gateway om du skulle hämta där
+    verify = True
+    if url.startswith("https://192.168.50.230:3443"):
+        verify = False
+
+    reusable = bool(st.get("version"))
+    headers = {}
+    if reusable:
+        if st.get("etag"):
+            headers["If-None-Match"] = st["etag"]
+        if st.get("last_modified"):
+            headers["If-Modified-Since"] = st["last_modified"]
+
+    r = requests.get(url, timeout=20, verify=verify, headers=headers)
+    validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    if r.status_code == 304 and reusable:
+        return None, validators, None
+    r.raise_for_status()
+
+    body_hash = hashlib.sha256(r.content).hexdigest()
+    validators["body_hash"] = body_hash
+    if reusable and body_hash == st.get("body_hash"):
+        return None, validators, None
+    return r.content, validators, _parse_calendar(r.content)
+
+def _fetch_skola24(url: str, st: Dict) -> Tuple[Optional[bytes], Dict, Optional[Tuple]]:
     """
-    Hämtar ICS_URLS, expanderar händelser i ett generöst fönster och deduplicerar.
-    Mjuk-fail: om någon källa faller så fortsätter vi med resten.
+    "skola24:<klass>": lektionerna hämtas i processen ur blueprinten (ingen
+    HTTP-hop, ICS-text eller iCal-parse). Samma kontrakt som _fetch_source.
+    """
+    klass = url[len(SKOLA24_SOURCE_PREFIX):].strip()
+    data = {"calendar": f"{klass} ({SCHOOL_NAME})", "lessons": lessons_for_classes([klass])}
+    body = json.dumps(data, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    body_hash = hashlib.sha256(body).hexdigest()
+    validators = {"body_hash": body_hash}
+    if st.get("version") and body_hash == st.get("body_hash"):
+        return None, validators, None
+    return body, validators, _parse_lessons(body)
+
+def _event_sort_key(e: EventRecord) -> Tuple[int, str]:
+    return (e.start, e.summary)
+
+def _refresh_sources() -> List[Tuple[str, int]]:
+    """
+    Hämtar ICS_URLS parallellt och returnerar [(url, källversion)] i ICS_URLS-ordning.
+    Bara källor som faktiskt ändrats får ny version (och parsas om).
+    Mjuk-fail: om någon källa faller (eller inte hinner klart före
+    ICS_FETCH_DEADLINE_S) så fortsätter vi med resten, med källans senast lyckade
+    version. Källor som fallerar upprepat hoppas över med backoff.
     """
     urls = [u.strip() for u in os.getenv("ICS_URLS", "").split(",") if u.strip()]
     if not urls:
         return []
 
-    now = dt.datetime.now(TZ)
-    win_start = now - dt.timedelta(days=ICS_WINDOW_PAST_DAYS)
-    win_end = now + dt.timedelta(days=ICS_WINDOW_FUTURE_DAYS)
+    states = _store.source_states()
+    empty: Dict = {"version": 0, "fails": 0, "retry_at": 0.0}
+    versions = {u: (states.get(u) or empty)["version"] for u in urls}
+
+    todo = [u for u in urls if (states.get(u) or empty)["retry_at"] <= time.time()]
+
+    def failed(url: str, err) -> None:
+        # logga tyst i stdout så vi ser i journalen men låter andra källor passera
+        fails = (states.get(url) or empty)["fails"] + 1
+        _store.source_failed(url, fails, time.time() + _backoff_s(fails))
+        print(f"[ICS] WARN: kunde inte hämta {url} (fel #{fails}): {err}", file=sys.stderr)
+
+    if todo:
+        pool = ThreadPoolExecutor(max_workers=max(1, min(ICS_FETCH_WORKERS, len(todo))),
+                                  thread_name_prefix="ics-fetch")
+        futures = {
+            pool.submit(_fetch_skola24 if u.startswith(SKOLA24_SOURCE_PREFIX) else _fetch_source,
+                        u, states.get(u) or empty): u
+            for u in todo
+        }
+        try:
+            for fut in as_completed(futures, timeout=ICS_FETCH_DEADLINE_S):
+                url = futures[fut]
+                try:
+                    body, validators, parsed = fut.result()
+                    versions[url] = _store.source_ok(url, body, **validators)
+                    if parsed is not None:  # ändrad källa → redan parsad här
+                        _parsed[url] = (versions[url], parsed)
+                except Exception as e:
+                    failed(url, e)
+        except FuturesTimeout:
+            for fut, url in futures.items():
+                if not fut.done():
+                    failed(url, f"deadline {ICS_FETCH_DEADLINE_S:.0f}s passerad")
+        finally:
+            # vänta inte på efterslänare – de faller på sin egen timeout
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return [(u, versions[u]) for u in urls]
+
+def _merge_sources(lists: List[List[EventRecord]]) -> List[EventRecord]:
+    """
+    K-way merge av källornas sorterade listor + enkel dedup (id, start) → behåll
+    första. heapq.merge är stabil över källorna, så resultatet blir detsamma som
+    en full sortering av alla händelser i ICS_URLS-ordning.
+    """
+    out: List[EventRecord] = []
+    seen = set()
+    for e in heapq.merge(*lists, key=_event_sort_key):
+        key = (e.uid, e.start)
+        if key not in seen:
+            seen.add(key)
+            out.append(e)
+    return out
+
+# -------------------- Månadsvis expansion (lazy + LRU) --------------------
+
+def _parsed_source(url: str, version: int) -> Optional[Tuple]:
+    """Parsad kalender för källan; parsas om bara när källversionen ändrats."""
+    memo = _parsed.get(url)
+    if memo and memo[0] == version:
+        return memo[1]
+    stored_version, body = _store.source_body(url)
+    parsed = None
+    if body:
+        try:
+            parsed = _parse_source(url, body)
+        except Exception as e:
+            print(f"[ICS] WARN: kunde inte parsa {url}: {e}", file=sys.stderr)
+    _parsed[url] = (stored_version, parsed)
+    return parsed
+
+def _month_range(month: Tuple[int, int]) -> Tuple[dt.datetime, dt.datetime]:
+    y, m = month
+    start = dt.datetime(y, m, 1, tzinfo=TZ)
+    end = dt.datetime(y + (m == 12), m % 12 + 1, 1, tzinfo=TZ)
+    return start, end
+
+def _months_between(t_min: int, t_max: int) -> List[Tuple[int, int]]:
+    """Lokala månader som [t_min, t_max) berör, högst ICS_MAX_QUERY_MONTHS stycken."""
+    if t_max <= t_min:
+        return []
+    first = dt.datetime.fromtimestamp(t_min, TZ)
+    last = dt.datetime.fromtimestamp(t_max - 1, TZ)
+    months: List[Tuple[int, int]] = []
+    y, m = first.year, first.month
+    while (y, m) <= (last.year, last.month) and len(months) < ICS_MAX_QUERY_MONTHS:
+        months.append((y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+def _served_t_max(t_min: int, t_max: int) -> int:
+    """
+    Fönstrets faktiska slut: t_max, eller slutet av sista tillåtna månaden om
+    fönstret spänner över fler än ICS_MAX_QUERY_MONTHS månader.
+    """
+    months = _months_between(t_min, t_max)
+    if len(months) < ICS_MAX_QUERY_MONTHS:
+        return t_max
+    return min(t_max, int(_month_range(months[-1])[1].timestamp()))
+
+def _source_month(url: str, version: int, month: Tuple[int, int]) -> List[EventRecord]:
+    key = (url, version, month)
+    events = _source_months.get(key)
+    if events is None:
+        parsed = _parsed_source(url, version)
+        events = _expand_parsed(parsed, *_month_range(month)) if parsed else []
+        events.sort(key=_event_sort_key)  # sorterad per källa → k-way merge räcker
+        _source_months.put(key, events)
+    return events
+
+def _month_index(sources: List[Tuple[str, int]], month: Tuple[int, int]) -> EventIndex:
+    """Sammanfogat intervallindex för en månad; bara ändrade källor expanderas om."""
+    key = (tuple(sources), month)
+    index = _merged_months.get(key)
+    if index is not None:
+        return index
+    with _expand_lock:
+        index = _merged_months.get(key)
+        if index is None:
+            lists = [_source_month(u, v, month) for u, v in sources if v]
+            index = EventIndex(_merge_sources(lists))
+            _merged_months.put(key, index)
+    return index
+
+def _events_between(sources: List[Tuple[str, int]], t_min: int, t_max: int) -> List[EventRecord]:
+    """
+    Händelser som överlappar [t_min, t_max), sorterade på start. Månader läggs
+    efter varandra; händelser som spänner över månadsskiften dedupliceras.
+    """
+    out: List[EventRecord] = []
+    seen = set()
+    for month in _months_between(t_min, t_max):
+        for e in _month_index(sources, month).between(t_min, t_max):
+            key = (e.uid, e.start)
+            if key not in seen:
+                seen.add(key)
+                out.append(e)
+    return out
+
+# -------------------- AI-jobb (planering i bakgrunden) --------------------
+
+AI_JOBS_PATH = Path(os.getenv("AI_JOBS_PATH", str(DATA_DIR / "ai_jobs.sqlite3")))
+AI_JOB_WORKERS = max(1, int(os.getenv("AI_JOB_WORKERS", "1")))  # samtidiga planeringar, alla workers
+AI_JOB_TIMEOUT_S = float(os.getenv("AI_JOB_TIMEOUT_S", str(60 * 10)))
+AI_JOB_POLL_S = float(os.getenv("AI_JOB_POLL_S", "5"))
+AI_JOB_OUTPUT_LINES = 200  # så mycket av stdout som sparas i jobbresultatet
+_jobs = JobStore(AI_JOBS_PATH)
+_job_pool = ThreadPoolExecutor(max_workers=AI_JOB_WORKERS, thread_name_prefix="ai-job")
+# En varm planeringsprocess per jobbtråd; startas i förväg hos den worker som
+# äger jobbkön (se _claim_job_runner) och hålls igång mellan jobben
+_planners: "queue.LifoQueue[PlannerProcess]" = queue.LifoQueue()
+for _ in range(AI_JOB_WORKERS):
+    _planners.put(PlannerProcess())
+_job_runner_started = False
+_job_runner_lock = threading.Lock()
+_job_runner_lock_fd = None
+_job_wake = threading.Event()
+
+def _plan_week_key() -> str:
+    """Dedup-nyckel: ai_agent.py planerar alltid innevarande ISO-vecka."""
+    year, week, _ = dt.date.today().isocalendar()
+    return f"planera:{year}-W{week:02d}"
+
+def _job_json(job: Dict) -> Dict:
+    return {
+        "jobId": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "message": job["message"],
+        "result": job["result"],
+        "createdAt": job["created_at"],
+        "startedAt": job["started_at"],
+        "finishedAt": job["finished_at"],
+    }
+
+def _run_planner(job_id: str, started: float) -> Tuple[bool, str, Dict]:
+    """
+    Kör planeringen i en varm planeringsprocess (planner_worker.py). Varje
+    utskriven rad blir jobbets progress; processen dödas efter AI_JOB_TIMEOUT_S
+    och startas om vid nästa jobb. Returnerar (ok, meddelande, resultat).
+    """
+    planner = _planners.get()
+    try:
+        outcome, error, lines = planner.run(
+            job_id, lambda line: _jobs.progress(job_id, line[:300]), AI_JOB_TIMEOUT_S
+        )
+    finally:
+        _warm_planner(planner)  # dödad/kraschad process värms upp igen före nästa jobb
+        _planners.put(planner)
+    result = {"stdout": "\n".join(lines[-AI_JOB_OUTPUT_LINES:])}
+    if error:
+        result["error"] = error
+
+    if outcome == "timeout":
+        return False, "Planeringen tog för lång tid och avbröts (timeout).", result
+    if outcome != "ok":
+        return False, "Kunde inte skapa matsedel.", result
+    # ai_agent.run() fångar egna fel och skriver dem till ai_status.json
+    st = _read_status()
+    try:
+        fresh = datetime.fromisoformat(st.get("timestamp", "")).timestamp() >= started - 1
+    except (TypeError, ValueError):
+        fresh = False
+    if fresh and not st.get("success", False):
+        return False, st.get("message") or "Kunde inte skapa matsedel.", result
+    return True, "Planeringen slutförd.", result
+
+def _execute_job(job: Dict) -> None:
+    try:
+        ok, message, result = _run_planner(job["id"], job["started_at"])
+    except Exception as e:
+        ok, message, result = False, f"Undantag i planeringsjobb: {e.__class__.__name__}: {e}", None
+    try:
+        _jobs.finish(job["id"], ok, message, result)
+    except Exception as e:
+        print(f"[AI] WARN: kunde inte spara jobbstatus för {job['id']}: {e}", file=sys.stderr)
+    _job_wake.set()  # en plats blev ledig – se om något mer ligger i kö
 
-    events: List[Dict] = []
-    for url in urls:
+def _job_runner_loop() -> None:
+    """
+    Plockar köade jobb så länge det finns lediga platser. Bara den worker som
+    äger jobbkön plockar jobb; övriga försöker ta över ägarskapet varje
+    AI_JOB_POLL_S (om ägaren dör släpps låset). Gränsen gäller över alla
+    workers (räknas i SQLite); ägaren pollar så att jobb köade av en annan
+    worker plockas upp inom AI_JOB_POLL_S.
+    """
+    stale_after = AI_JOB_TIMEOUT_S + 120
+    owner = False
+    while True:
+        if not owner and _claim_job_runner():
+            owner = True
+            if _job_runner_lock_fd is not None:
+                try:
+                    # Körande jobb från en tidigare (död) ägare blockerar annars kön
+                    # tills de blir inaktuella efter stale_after
+                    _jobs.fail_orphans(os.getpid())
+                except Exception as e:
+                    print(f"[AI] WARN: kunde inte avsluta föräldralösa jobb: {e}", file=sys.stderr)
+            for planner in list(_planners.queue):
+                threading.Thread(target=_warm_planner, args=(planner,),
+                                 name="ai-planner-prewarm", daemon=True).start()
         try:
-            # Tillåt self-signed på din gateway om du skulle hämta där
-            verify = True
-            if url.startswith("https://192.168.50.230:3443"):
-                verify = False
-            r = requests.get(url, timeout=20, verify=verify)
-            r.raise_for_status()
-            events.extend(_expand_ics(r.content, win_start, win_end))
+            while owner:
+                job = _jobs.claim(AI_JOB_WORKERS, stale_after)
+                if job is None:
+                    break
+                _job_pool.submit(_execute_job, job)
         except Exception as e:
-            # logga tyst i stdout så vi ser i journalen men låter andra källor passera
-            print(f"[ICS] WARN: kunde inte hämta {url}: {e}", file=sys.stderr)
-            continue
-
-    # sortera + enkel dedup (id, start) → behåll första
-    events.sort(key=lambda e: (e.get("start") or "", e.get("summary") or ""))
-    uniq: Dict[str, Dict] = {}
-    for e in events:
-        key = f"{e.get('id')}|{e.get('start')}"
-        if key not in uniq:
-            uniq[key] = e
-    return list(uniq.values())
+            print(f"[AI] WARN: jobbkön misslyckades: {e}", file=sys.stderr)
+        _job_wake.wait(AI_JOB_POLL_S)
+        _job_wake.clear()
+
+def _claim_job_runner() -> bool:
+    """
+    Bara en worker per maskin kör planeringar och håller varma processer: den
+    som får ett exklusivt flock på en låsfil bredvid jobbdatabasen (hålls tills
+    processen dör). Utan flock (Windows) kör varje worker jobb själv.
+    """
+    global _job_runner_lock_fd
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    fd = None
+    try:
+        fd = open(str(AI_JOBS_PATH) + ".runner.lock", "a")
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        if fd is not None:
+            fd.close()
+        return False
+    _job_runner_lock_fd = fd
+    return True
+
+def _warm_planner(planner: PlannerProcess) -> None:
+    """Starta planeringsprocessen i förväg så att nästa jobb slipper uppstarten."""
+    try:
+        planner.start()
+    except Exception as e:
+        print(f"[AI] WARN: kunde inte förvärma planeringsprocessen: {e}", file=sys.stderr)
+
+@app.before_request
+def _ensure_job_runner() -> None:
+    """Startar jobbtråden lazy i varje worker vid första anropet (efter fork, inte vid import)."""
+    global _job_runner_started
+    if _job_runner_started:
+        return
+    with _job_runner_lock:
+        if not _job_runner_started:
+            threading.Thread(target=_job_runner_loop, name="ai-jobs", daemon=True).start()
+            _job_runner_started = True
 
 # -------------------- API-routes --------------------
 
@@ -266,41 +674,34 @@ def _read_status():
 
 @app.route("/api/ai-status", methods=["GET"])
 def ai_status():
-    return jsonify(_read_status()), 200
+    """
+    Utan parametrar: senaste ai_status.json (som tidigare).
+    ?job=<id>: status, progress och resultat för ett planeringsjobb.
+    """
+    job_id = request.args.get("job")
+    if not job_id:
+        return jsonify(_read_status()), 200
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "fail", "message": f"Okänt jobb: {job_id}"}), 404
+    return jsonify(_job_json(job)), 200
 
 @app.route("/api/planera", methods=["POST"])
 def planera():
     """
-    Kör ai_agent.py i en subprocess och returnerar stdout/stderr som JSON.
+    Köar en veckoplanering och svarar direkt med 202 + jobb-id. Själva körningen
+    sker i bakgrunden; följ den via /api/ai-status?job=<id>. Pågår redan en
+    planering för samma vecka returneras det jobbet i stället för ett nytt.
     """
     try:
-        result = subprocess.run(
-            [sys.executable, "ai_agent.py"],
-            capture_output=True,
-            text=True,
-            env=os.environ.copy(),
-            cwd=str(HERE),
-            timeout=60 * 10  # 10 min
-        )
-
-        if result.returncode == 0:
-            return jsonify({
-                "status": "ok",
-                "message": "Planeringen slutförd.",
-                "stdout": (result.stdout or "").strip()
-            }), 200
-
-        return jsonify({
-            "status": "fail",
-            "message": "Kunde inte skapa matsedel.",
-            "stderr": (result.stderr or "").strip(),
-            "stdout": (result.stdout or "").strip()
-        }), 500
-
-    except subprocess.TimeoutExpired:
-        return jsonify({"status": "fail", "message": "Planeringen tog för lång tid och avbröts (timeout)."}), 504
+        job, created = _jobs.submit("planera", _plan_week_key())
     except Exception as e:
         return jsonify({"status": "fail", "message": f"Undantag i /api/planera: {e.__class__.__name__}: {e}"}), 500
+    _job_wake.set()
+    body = _job_json(job)
+    body["deduplicated"] = not created
+    body["statusUrl"] = f"/api/ai-status?job={job['id']}"
+    return jsonify(body), 202
 
 @app.route("/api/byt-middag", methods=["POST"])
 def byt_middag():
@@ -324,44 +725,154 @@ def byt_middag():
     except Exception as e:
         return jsonify({"status": "fail", "message": f"Undantag i /api/byt-middag: {e}"}), 500
 
-@app.route("/api/events", methods=["GET"])
-def api_events():
+def _sync_local(meta: Tuple) -> None:
+    """Ta över den delade snapshotens version och källversioner lokalt."""
+    global _cache_version, _cache_built_at, _cache_expires_at, _cache_sources, _meta_read_at
+    version, built_at, expires_at, sources = meta
+    with _cache_lock:
+        _cache_version, _cache_built_at, _cache_expires_at, _cache_sources = version, built_at, expires_at, sources
+        _meta_read_at = time.monotonic()
+
+_refresh_flight = SingleFlight()
+
+def _refresh_snapshot() -> bool:
     """
-    Returnerar sammanfogade ICS-händelser (från ICS_URLS) filtrerade på timeMin/timeMax.
+    Hämtar om källorna och publicerar deras versioner om vi får refresh-låset.
+    Returnerar False om en annan worker redan håller på (då serverar vi vidare
+    det vi har). Oförändrade källor ger samma snapshot-version. Samtidiga
+    anrop i samma worker delar på en refresh (single-flight).
     """
-    global _cache_until, _cache_events
-    now = datetime.now(timezone.utc)
+    return _refresh_flight.do("snapshot", _refresh_snapshot_once)
 
-    # Ladda cache vid behov
-    if _cache_until is None or now >= _cache_until:
+def _refresh_snapshot_once() -> bool:
+    if not _store.try_lock():
+        return False
+    try:
+        _store.publish(_refresh_sources(), CACHE_TTL.total_seconds())
+        meta = _store.meta()
+        if meta:
+            _sync_local(meta)
+    finally:
+        _store.release()
+    return True
+
+def _prewarm() -> None:
+    """Expandera månaderna i standardfönstret så att vanliga anrop aldrig expanderar."""
+    now = time.time()
+    sources = _cache_sources
+    for month in _months_between(int(now - ICS_WINDOW_PAST_DAYS * 86400),
+                                 int(now + ICS_WINDOW_FUTURE_DAYS * 86400)):
+        _month_index(sources, month)
+
+# -------------------- Bakgrundsrefresh (stale-while-revalidate) --------------------
+
+_refresher_started = False
+_refresher_lock = threading.Lock()
+_refresher_wake = threading.Event()
+
+def _refresher_loop() -> None:
+    prewarmed = None
+    while True:
         try:
-            _cache_events = _refresh_events()
-            _cache_until = now + CACHE_TTL
+            meta = _store.meta()
+            if meta:
+                _sync_local(meta)
+            if meta is None or time.time() >= meta[2] - EVENTS_REFRESH_AHEAD_S:
+                _refresh_snapshot()
+            if _cache_version is not None and (_cache_version, dt.date.today()) != prewarmed:
+                _prewarm()
+                prewarmed = (_cache_version, dt.date.today())
         except Exception as e:
-            if not _cache_events:
-                return jsonify({"status": "fail", "error": str(e)}), 502
+            print(f"[ICS] WARN: bakgrundsrefresh misslyckades: {e}", file=sys.stderr)
+            try:
+                _store.postpone(min(60.0, CACHE_TTL.total_seconds()))
+            except Exception:
+                pass
+        _refresher_wake.wait(EVENTS_REFRESH_CHECK_S)
+        _refresher_wake.clear()
+
+def _ensure_refresher() -> None:
+    """Startar refresh-tråden lazy i varje worker (efter fork, inte vid import)."""
+    global _refresher_started
+    if _refresher_started:
+        return
+    with _refresher_lock:
+        if not _refresher_started:
+            threading.Thread(target=_refresher_loop, name="ics-refresher", daemon=True).start()
+            _refresher_started = True
+
+def _current_sources() -> List[Tuple[str, int]]:
+    """
+    Returnerar senaste snapshotens källversioner direkt, även om den passerat TTL –
+    refresh sker i bakgrunden. Bara vid kall start (ingen snapshot alls) får anropet vänta.
+    Den delade raden läses högst var EVENTS_META_CHECK_S, så att cacheträffar inte
+    öppnar databasen.
+    """
+    _ensure_refresher()
+    if _cache_version is None or time.monotonic() - _meta_read_at >= EVENTS_META_CHECK_S:
+        meta = _store.meta()
+        if meta:
+            _sync_local(meta)
+    if _cache_version is not None:
+        if time.time() >= _cache_expires_at:
+            _refresher_wake.set()
+        return _cache_sources
+
+    if _refresh_snapshot():
+        return _cache_sources
+
+    # Kall start: en annan worker bygger redan snapshoten – vänta in den
+    deadline = time.monotonic() + EVENTS_COLD_WAIT_S
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        meta = _store.meta()
+        if meta:
+            _sync_local(meta)
+            return _cache_sources
+    raise RuntimeError("Händelsecachen byggs fortfarande, försök igen")
+
+def _epoch_param(val: Optional[str], default: datetime) -> int:
+    t = _parse_time_param(val, default)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=TZ)  # naiva tider antas vara lokal tid
+    return int(t.timestamp())
+
+@app.route("/api/events", methods=["GET"])
+def api_events():
+    """
+    Returnerar sammanfogade ICS-händelser (från ICS_URLS) som överlappar timeMin/timeMax,
+    sorterade på start. Månader utanför förvärmt fönster expanderas vid behov.
+    Stark ETag ur kroppen: oförändrad data ger 304 utan kropp, även när
+    standardfönstret flyttats fram.
+    Fönster längre än ICS_MAX_QUERY_MONTHS kortas av; då anger X-Range-Truncated
+    (ISO8601) var det levererade fönstret slutar.
+    """
+    step = max(1, EVENTS_WINDOW_STEP_S)
+    now = datetime.fromtimestamp(int(time.time()) // step * step, timezone.utc)
+
+    try:
+        sources = _current_sources()
+    except Exception as e:
+        return jsonify({"status": "fail", "error": str(e)}), 502
 
     # Tolka fönster (default: ±180 dagar)
-    time_min = _parse_time_param(request.args.get("timeMin"), now - timedelta(days=180))
-    time_max = _parse_time_param(request.args.get("timeMax"), now + timedelta(days=180))
-
-    def in_range(ev: Dict) -> bool:
-        start_s = ev.get("start") or ev.get("startTime")
-        if not start_s:
-            return False
-        s_txt = str(start_s)
-        if s_txt.endswith('Z'):
-            s_txt = s_txt[:-1] + '+00:00'
-        try:
-            s_dt = dt.datetime.fromisoformat(s_txt)
-        except Exception:
-            return False
-        return (s_dt >= time_min) and (s_dt < time_max)
-
-    out = [e for e in _cache_events if in_range(e)]
-    # sortera snyggt på start
-    out.sort(key=lambda e: e.get("start") or "")
-    return jsonify(out)
+    t_min = _epoch_param(request.args.get("timeMin"), now - timedelta(days=180))
+    t_max = _epoch_param(request.args.get("timeMax"), now + timedelta(days=180))
+    headers = {"Cache-Control": "no-cache"}
+    served_max = _served_t_max(t_min, t_max)
+    if served_max < t_max:
+        t_max = served_max
+        headers["X-Range-Truncated"] = datetime.fromtimestamp(t_max, TZ).isoformat()
+
+    key = (tuple(sources), t_min, t_max)
+    cached = _bodies.get(key)
+    if cached is None:
+        body = join_fragments(_events_between(sources, t_min, t_max))
+        cached = CachedBody(body)  # ETag ur innehållet: samma händelser ger 304 även när fönstret flyttats
+        _bodies.put(key, cached)
+    # ålder på äldsta lyckade källhämtning – växer under ett uppströmsavbrott
+    headers["X-Cache-Age"] = str(max(0, int(time.time() - _cache_built_at)))
+    return conditional_response(cached, "application/json", headers)
 
 @app.route("/api/events-ics", methods=["GET"])
 def api_events_ics():
@@ -0,0 +1,186 @@
+# backend/planner_worker.py
+"""
+Långlivad planeringsprocess för ai_agent.
+
+Tidigare startade varje planering en ny Python-tolk (`python ai_agent.py`),
+som importerade openai/supabase, skapade klienter, satte upp loggning och
+läste konfig innan det riktiga arbetet började. Här startas tolken en gång
+och hålls varm: föräldern (API-workern) skickar jobb som JSON-rader på stdin
+och läser händelser som JSON-rader från stdout.
+
+  förälder → barn:  {"job": "<id>"}
+  barn → förälder:  {"event": "ready"}
+                    {"event": "progress", "job": "<id>", "line": "..."}
+                    {"event": "done", "job": "<id>", "ok": true, "error": null}
+
+Barnet är en egen process: kraschar den (eller hänger sig och dödas vid
+timeout) påverkas inte API:t, och en ny process startas före nästa jobb.
+"""
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+HERE = Path(__file__).resolve().parent
+
+
+# -------------------- Barnprocessen --------------------
+
+class _LineStream:
+    """Fil-liknande objekt som skickar varje hel rad till en callback."""
+
+    def __init__(self, emit: Callable[[str], None]) -> None:
+        self._emit = emit
+        self._buf = ""
+
+    def write(self, s: str) -> int:
+        self._buf += s
+        while "\n" in self._buf:
+            line, self._buf = self._buf.split("\n", 1)
+            self._emit(line)
+        return len(s)
+
+    def flush(self) -> None:
+        if self._buf:
+            self._emit(self._buf)
+            self._buf = ""
+
+
+def _child_main() -> None:
+    # Protokollet får egen kopia av stdout; allt annat som skrivs till fd 1
+    # (t.ex. utskrifter vid import) hamnar på stderr/serverloggen i stället.
+    proto = os.fdopen(os.dup(1), "w", encoding="utf-8", buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    send_lock = threading.Lock()
+
+    def send(**msg) -> None:
+        with send_lock:
+            proto.write(json.dumps(msg, ensure_ascii=False) + "\n")
+
+    import ai_agent
+    ai_agent.warm()  # klienter, loggning och konfig sätts upp en gång här
+    send(event="ready")
+
+    for raw in sys.stdin:
+        try:
+            job_id = json.loads(raw)["job"]
+        except (ValueError, KeyError, TypeError):
+            continue
+        stream = _LineStream(lambda line, j=job_id: line.strip() and send(event="progress", job=j, line=line))
+        ok, error = True, None
+        try:
+            with redirect_stdout(stream):
+                ai_agent.run()
+        except Exception as e:
+            ok, error = False, f"{e.__class__.__name__}: {e}"
+        stream.flush()
+        send(event="done", job=job_id, ok=ok, error=error)
+
+
+# -------------------- Föräldern (API-workern) --------------------
+
+class PlannerProcess:
+    """
+    En varm planeringsprocess. start() startar den i förväg; run() kör ett
+    jobb i taget (trådsäkert) och startar om processen om den dött. Vid
+    timeout dödas den.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._events: "queue.Queue[Optional[dict]]" = queue.Queue()
+
+    def _reader(self, proc: subprocess.Popen, events: "queue.Queue[Optional[dict]]") -> None:
+        for raw in proc.stdout:
+            try:
+                events.put(json.loads(raw))
+            except ValueError:
+                pass
+        events.put(None)  # EOF: processen har avslutats
+
+    def _alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self) -> None:
+        """Starta processen om den inte redan kör."""
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self) -> None:
+        if self._alive():
+            return
+        self._events = queue.Queue()
+        self._proc = subprocess.Popen(
+            [sys.executable, "-u", str(Path(__file__).resolve())],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            env=os.environ.copy(),
+            cwd=str(HERE),
+        )
+        threading.Thread(target=self._reader, args=(self._proc, self._events),
+                         name="ai-planner-reader", daemon=True).start()
+
+    def _kill_locked(self) -> None:
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+                self._proc.wait(timeout=5)
+            except Exception:
+                pass
+        self._proc = None
+
+    def run(self, job_id: str, on_progress: Callable[[str], None], timeout: float) -> Tuple[str, Optional[str], List[str]]:
+        """
+        Kör ett planeringsjobb. Returnerar (utfall, fel, utskrivna rader) där
+        utfall är "ok", "error" (run() kastade), "timeout" eller "crashed".
+        """
+        with self._lock:
+            self._start_locked()
+            return self._run_locked(job_id, on_progress, timeout)
+
+    def _run_locked(self, job_id: str, on_progress: Callable[[str], None],
+                    timeout: float) -> Tuple[str, Optional[str], List[str]]:
+        lines: List[str] = []
+        deadline = time.monotonic() + timeout
+        try:
+            self._proc.stdin.write(json.dumps({"job": job_id}) + "\n")
+            self._proc.stdin.flush()
+        except OSError as e:
+            self._kill_locked()
+            return "crashed", f"kunde inte skicka jobbet: {e}", lines
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._kill_locked()
+                return "timeout", None, lines
+            try:
+                ev = self._events.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if ev is None:
+                code = self._proc.wait() if self._proc else None
+                self._proc = None
+                return "crashed", f"planeringsprocessen avslutades (exitkod {code})", lines
+            kind = ev.get("event")
+            if ev.get("job") != job_id:
+                continue  # "ready" och rester från ett tidigare jobb
+            elif kind == "progress":
+                lines.append(ev["line"])
+                on_progress(ev["line"])
+            elif kind == "done":
+                return ("ok" if ev.get("ok") else "error"), ev.get("error"), lines
+
+
+if __name__ == "__main__":
+    _child_main()
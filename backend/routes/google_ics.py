@@ -1,5 +1,6 @@
 # backend/routes/google_ics.py
 import os
+import hashlib
 import datetime as dt
 from typing import List, Dict, Optional
 
@@ -8,12 +9,18 @@ from flask import Blueprint, request, jsonify
 from icalendar import Calendar
 from dateutil.tz import gettz
 
+from singleflight import SingleFlight
+
 bp = Blueprint("google_ics", __name__)
 
 TZ = gettz("Europe/Stockholm")
 CACHE_TTL = dt.timedelta(minutes=5)
 _cache_until: Optional[dt.datetime] = None
 _cache_events: List[Dict] = []
+# Per URL: ETag/Last-Modified/innehållshash + senast parsade händelser
+_sources: Dict[str, Dict] = {}
+# Samtidiga anrop när cachen gått ut delar på en refresh
+_refresh_flight = SingleFlight()
 
 def _to_iso(x):
     # x kan vara date eller datetime
@@ -45,15 +52,43 @@ def _parse_ics(ics_bytes: bytes) -> List[Dict]:
         })
     return out
 
+def _fetch_conditional(url: str) -> List[Dict]:
+    """
+    Villkorlig GET: skickar If-None-Match/If-Modified-Since och återanvänder
+    tidigare parsade händelser vid 304 eller oförändrad innehållshash.
+    """
+    prev = _sources.get(url)
+    headers = {}
+    if prev:
+        if prev.get("etag"):
+            headers["If-None-Match"] = prev["etag"]
+        if prev.get("last_modified"):
+            headers["If-Modified-Since"] = prev["last_modified"]
+    r = requests.get(url, timeout=15, headers=headers)
+    if r.status_code == 304 and prev:
+        return prev["events"]
+    r.raise_for_status()
+
+    body_hash = hashlib.sha256(r.content).hexdigest()
+    if prev and prev.get("hash") == body_hash:
+        events = prev["events"]
+    else:
+        events = _parse_ics(r.content)
+    _sources[url] = {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "hash": body_hash,
+        "events": events,
+    }
+    return events
+
 def _refresh() -> List[Dict]:
     urls = [u.strip() for u in os.getenv("ICS_URLS", "").split(",") if u.strip()]
     if not urls:
         return []
     events: List[Dict] = []
     for url in urls:
-        r = requests.get(url, timeout=15)
-        r.raise_for_status()
-        events.extend(_parse_ics(r.content))
+        events.extend(_fetch_conditional(url))
 
     # sortera + enkel dedup på (id, start)
     events.sort(key=lambda e: (e["start"], e["summary"]))
@@ -64,14 +99,20 @@ def _refresh() -> List[Dict]:
             uniq[key] = e
     return list(uniq.values())
 
+def _refresh_cache() -> None:
+    """Kör under single-flight: uppdatera cachen om ingen annan hunnit före."""
+    global _cache_until, _cache_events
+    now = dt.datetime.now(TZ)
+    if _cache_until is None or now >= _cache_until:
+        _cache_events = _refresh()
+        _cache_until = now + CACHE_TTL
+
 @bp.route("/api/events", methods=["GET"])
 def get_events():
-    global _cache_until, _cache_events
     now = dt.datetime.now(TZ)
     if _cache_until is None or now >= _cache_until:
         try:
-            _cache_events = _refresh()
-            _cache_until = now + CACHE_TTL
+            _refresh_flight.do("events", _refresh_cache)
         except Exception as e:
             if _cache_events:
                 # returnera gammal cache om vi har en
@@ -0,0 +1,58 @@
+# backend/singleflight.py
+"""
+Single-flight: samtidiga anrop med samma nyckel delar på en enda beräkning.
+
+Första anroparen (ledaren) kör funktionen; de som kommer medan den pågår väntar
+och får samma resultat – eller samma undantag. När beräkningen är klar glöms
+nyckeln, så nästa anrop efter det gör en ny beräkning (cachning sköts av
+anroparen). Används för uppströmsanrop som annars körs en gång per väntande
+request när en cache löper ut.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Nyckel → pågående beräkning. Trådsäker; en instans per användningsområde."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0       # beräkningar som faktiskt körts
+        self.coalesced = 0   # anrop som fick en annan tråds resultat
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
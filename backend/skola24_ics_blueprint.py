@@ -4,29 +4,40 @@
 #   app.register_blueprint(skola24_bp, url_prefix="/skola24")
 # Endpoints:
 #   GET /skola24/ics/<klass>       (e.g., /skola24/ics/Class_A
+#   GET /skola24/ics?classes=A,B   (merged calendar, CATEGORIES per class)
+#   GET /skola24/lessons/<klass>   (lessons as JSON; also ?classes=A,B)
 #   GET /skola24/units             (lists units)
 #   GET /skola24/units/debug       (raw debug for unit listing)
 #   GET /skola24/schoolyears/debug (raw debug for school year)
+#   GET /skola24/cache/debug       (cache size, hits/misses/evictions)
 #   GET /skola24/                  (service info)
 
 from __future__ import annotations
 
 import os
+import json
+import random
+import hashlib
+import sys
+import sqlite3
+import threading
 import time as _time
-from typing import Any, Dict, List, Tuple
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
 from datetime import datetime, date, time as dtime, timedelta
 
-# Optional .env auto-load (safe fallback if package missing)
-try:
-    from dotenv import load_dotenv  # type: ignore
-    load_dotenv()
-except Exception:
-    pass
+# .env laddas av värdappen (planera_api) innan blueprinten importeras
 
 import requests
 from flask import Blueprint, Response, jsonify, request, abort
 from zoneinfo import ZoneInfo
 
+from http_cache import CachedBody, conditional_response, make_tag
+from singleflight import SingleFlight
+
 # -------------------- Config --------------------
 BASE = "https://web.skola24.se"
 HOST = os.getenv("SKOLA24_HOST", "example.skola24.se")
@@ -41,6 +52,48 @@ DEFAULT_WEEKS_AHEAD = int(os.getenv("DEFAULT_WEEKS_AHEAD", "3"))
 # Cache TTL per (class, week, year) render
 CACHE_TTL = int(os.getenv("CACHE_TTL", str(24 * 3600)))  # 24h
 
+# Läsårs- och klass-GUID:er byts i praktiken en gång per läsår: cacha länge,
+# men hämta om i bakgrunden när värdet är äldre än SKOLA24_LOOKUP_REFRESH_S
+LOOKUP_TTL = int(os.getenv("SKOLA24_LOOKUP_TTL", str(30 * 24 * 3600)))  # 30 dagar
+LOOKUP_REFRESH_S = int(os.getenv("SKOLA24_LOOKUP_REFRESH_S", str(24 * 3600)))  # 24h
+
+# Max antal poster i blueprintens cache (LRU) och hur ofta utgångna rensas
+CACHE_MAX_ITEMS = max(1, int(os.getenv("SKOLA24_CACHE_MAX_ITEMS", "2048")))
+CACHE_SWEEP_S = int(os.getenv("SKOLA24_CACHE_SWEEP_S", "300"))
+
+# Delad diskcache (SQLite) för renderingar och uppslag: överlever omstart och
+# delas av alla gunicorn-workers. Tom SKOLA24_CACHE_PATH stänger av den.
+_DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / "data" / "skola24_cache.sqlite3"
+CACHE_PATH = os.getenv("SKOLA24_CACHE_PATH", str(_DEFAULT_CACHE_PATH)).strip()
+# Passerade veckor ändras inte: behåll dem i princip för alltid
+PAST_WEEK_TTL = int(os.getenv("SKOLA24_PAST_WEEK_TTL", str(365 * 24 * 3600)))
+
+# Förrendering av DEFAULT_CLASSES: varje natt + vardagsmorgnar före skolstart
+# (lokal tid, HH:MM), med slumpad fördröjning så att vi inte träffar Skola24 prick.
+PRERENDER_ENABLED = os.getenv("SKOLA24_PRERENDER", "1").strip().lower() not in ("0", "false", "no", "")
+PRERENDER_NIGHTLY = os.getenv("SKOLA24_PRERENDER_NIGHTLY", "02:30")
+PRERENDER_MORNING = os.getenv("SKOLA24_PRERENDER_MORNING", "06:15")
+PRERENDER_JITTER_S = int(os.getenv("SKOLA24_PRERENDER_JITTER_S", "600"))
+# En kalender där någon vecka inte gick att rendera sparas bara så här länge
+# som "senaste" (och renderas om i bakgrunden direkt)
+PARTIAL_RETRY_S = int(os.getenv("SKOLA24_PARTIAL_RETRY_S", "60"))
+# Hur ofta en worker kollar i diskcachen om förrenderingen (i en annan worker)
+# publicerat en ny generation – då släpps workerns egna renderingar i minnet
+GENERATION_CHECK_S = float(os.getenv("SKOLA24_GENERATION_CHECK_S", "1"))
+
+# Fönster på minst så här många veckor (en termin eller mer) strömmas vid kall
+# start i stället för att vänta på en färdig kropp; vanliga fönster (väggens
+# 0+8 veckor) går alltid via den förrenderade/senaste kroppen
+STREAM_MIN_WEEKS = int(os.getenv("SKOLA24_STREAM_MIN_WEEKS", "20"))
+
+# Render-nyckeln återanvänds så här länge (hämtas om direkt om Skola24 avvisar den)
+RENDER_KEY_TTL = int(os.getenv("SKOLA24_RENDER_KEY_TTL", "120"))
+
+# Max antal veckor som renderas samtidigt (delar sess och dess connection pool)
+RENDER_WORKERS = max(1, int(os.getenv("SKOLA24_RENDER_WORKERS", "4")))
+
+ICS_MIMETYPE = "text/calendar; charset=utf-8"
+
 TZ_LOCAL = ZoneInfo("Europe/Stockholm")
 TZ_UTC = ZoneInfo("UTC")
 
@@ -72,12 +125,17 @@ sess = requests.Session()
 def get_active_school_year_guid() -> str:
     """
     Matchar HA: /api/get/active/school/years → ta första GUID.
+    Cachas länge och förnyas i bakgrunden (se _cached_lookup).
     """
+    return _cached_lookup(("school_year_guid", HOST), _fetch_active_school_year_guid)
+
+
+def _fetch_active_school_year_guid() -> str:
     body = {
         "hostName": HOST,
         "checkSchoolYearsFeatures": "false"
     }
-    r = sess.post("https://web.skola24.se/api/get/active/school/years", json=body, headers=COMMON_HEADERS, timeout=30)
+    r = _upstream_post("https://web.skola24.se/api/get/active/school/years", body)
     r.raise_for_status()
     data = r.json()
     sy = (((data or {}).get("data") or {}).get("activeSchoolYears") or [])
@@ -86,19 +144,31 @@ def get_active_school_year_guid() -> str:
     return sy[0]["guid"]  # GUID, inte siffra
 
 
-def get_class_guid(klass: str, unit_guid: str) -> str:
+def get_classes(unit_guid: str) -> List[dict]:
     """
-    Matchar HA: /api/get/timetable/selection → hämta groupGuid för klass.
+    Matchar HA: /api/get/timetable/selection → alla klasser för enheten.
+    Cachas länge och förnyas i bakgrunden (se _cached_lookup).
     """
+    return _cached_lookup(("classes", HOST, unit_guid), lambda: _fetch_classes(unit_guid))
+
+
+def _fetch_classes(unit_guid: str) -> List[dict]:
     body = {
         "hostname": HOST,
         "unitGuid": unit_guid,
         "filters": { "class": "true" }
     }
-    r = sess.post("https://web.skola24.se/api/get/timetable/selection", json=body, headers=COMMON_HEADERS, timeout=30)
+    r = _upstream_post("https://web.skola24.se/api/get/timetable/selection", body)
     r.raise_for_status()
     data = r.json()
-    classes = (((data or {}).get("data") or {}).get("classes") or [])
+    return (((data or {}).get("data") or {}).get("classes") or [])
+
+
+def get_class_guid(klass: str, unit_guid: str) -> str:
+    """
+    Hämta groupGuid för klass ur den cachade klasslistan.
+    """
+    classes = get_classes(unit_guid)
     # enkel normalisering
     want = klass.strip().lower()
     for c in classes:
@@ -107,6 +177,7 @@ def get_class_guid(klass: str, unit_guid: str) -> str:
     raise RuntimeError(f"Skola24: kunde inte matcha klass '{klass}'. Tillgängligt: {[c.get('groupName') for c in classes]}")
 
 def warmup_session() -> None:
+    """Hämtar viewer-sidan en gång så att sessionen får Skola24:s cookies."""
     url = f"{BASE}/portal/start/timetable/timetable-viewer/{HOST}/"
     headers = {
         "User-Agent": "Mozilla/5.0",
@@ -118,32 +189,254 @@ def warmup_session() -> None:
     except Exception:
         pass
 
-warmup_session()
+
+# Uppvärmningen körs i bakgrunden vid första uppströmsanropet (från en route,
+# förrenderingen eller planera_api:s skola24:-källor), inte vid import: en
+# worker ska kunna boota (och svara på /api/health) även utan nätverk.
+_warmup_started = False
+_warmup_lock = threading.Lock()
+
+
+def _upstream_post(url: str, json_body: Any) -> requests.Response:
+    """Alla POST mot Skola24 går härigenom, så att sessionen alltid värms upp."""
+    _ensure_warmup()
+    return sess.post(url, json=json_body, headers=COMMON_HEADERS, timeout=30)
+
+
+def _ensure_warmup() -> None:
+    global _warmup_started
+    if _warmup_started:
+        return
+    with _warmup_lock:
+        if not _warmup_started:
+            threading.Thread(target=warmup_session, name="skola24-warmup", daemon=True).start()
+            _warmup_started = True
 
 # -------------------- Simple cache --------------------
-class _Cache:
-    def __init__(self) -> None:
-        self._data: Dict[Tuple, Tuple[float, Any]] = {}
+class _DiskCache:
+    """
+    SQLite-tabell key → (expires_at, JSON-värde). Ny anslutning per anrop
+    (säkert över fork/trådar); fel loggas och räknas som miss.
+    """
 
-    def get(self, key: Tuple) -> Any:
-        item = self._data.get(key)
-        if not item:
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _key(key: Tuple) -> str:
+        return json.dumps(list(key), separators=(",", ":"), default=str)
+
+    def get(self, key: Tuple) -> Tuple[float, Any] | None:
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT expires_at, value FROM cache WHERE key = ?", (self._key(key),)
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[Skola24] WARN: diskcache läsning misslyckades: {e}", file=sys.stderr)
             return None
-        expires_at, value = item
-        if _time.time() > expires_at:
-            self._data.pop(key, None)
+        if not row:
             return None
-        return value
+        return float(row[0]), json.loads(row[1])
+
+    def set(self, key: Tuple, expires_at: float, value: Any) -> None:
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)",
+                    (self._key(key), expires_at, json.dumps(value, separators=(",", ":"))),
+                )
+            finally:
+                conn.close()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"[Skola24] WARN: diskcache skrivning misslyckades: {e}", file=sys.stderr)
+
+    def sweep(self, now: float) -> None:
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[Skola24] WARN: diskcache rensning misslyckades: {e}", file=sys.stderr)
+
+
+class _Cache:
+    """
+    Trådsäker TTL-cache med LRU-tak (max_items). Utgångna poster rensas vid
+    läsning och i ett svep högst var sweep_s sekund (körs vid set). Räknare för
+    träffar, missar, LRU-utkastningar och utgångna visas på /cache/debug.
+
+    Poster av slag i PERSISTENT_KINDS (renderingar och uppslag) skrivs även
+    till diskcachen och läses därifrån vid miss – så en ny eller omstartad
+    worker tar över det andra redan hämtat från Skola24.
+    """
+
+    PERSISTENT_KINDS = frozenset({"render", "school_year_guid", "classes", "unit_guid", "signature"})
+
+    def __init__(self, max_items: int = CACHE_MAX_ITEMS, sweep_s: int = CACHE_SWEEP_S,
+                 disk: _DiskCache | None = None) -> None:
+        self.max_items = max_items
+        self.sweep_s = sweep_s
+        self.disk = disk
+        self._data: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_sweep = _time.time() + sweep_s
+        self.hits = self.misses = self.evictions = self.expired = self.disk_hits = 0
+
+    def get(self, key: Tuple) -> Any:
+        now = _time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item:
+                expires_at, value = item
+                if now <= expires_at:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expired += 1
+
+        if self.disk is not None and key[0] in self.PERSISTENT_KINDS:
+            item = self.disk.get(key)
+            if item is not None and now <= item[0]:
+                with self._lock:
+                    self._put(key, item)
+                    self.disk_hits += 1
+                return item[1]
+
+        with self._lock:
+            self.misses += 1
+        return None
 
     def set(self, key: Tuple, value: Any, ttl: int = CACHE_TTL) -> None:
-        self._data[key] = (_time.time() + ttl, value)
+        now = _time.time()
+        with self._lock:
+            self._put(key, (now + ttl, value))
+            sweep = now >= self._next_sweep
+            if sweep:
+                self._sweep(now)
+        if self.disk is not None and key[0] in self.PERSISTENT_KINDS:
+            self.disk.set(key, now + ttl, value)
+            if sweep:
+                self.disk.sweep(now)
+
+    def drop_kinds(self, kinds: Iterable[str]) -> None:
+        """Släpp minnesposter av angivna slag (diskcachen lämnas orörd)."""
+        kinds = set(kinds)
+        with self._lock:
+            for k in [k for k in self._data if k[0] in kinds]:
+                del self._data[k]
+
+    def _put(self, key: Tuple, item: Tuple[float, Any]) -> None:
+        self._data[key] = item
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _sweep(self, now: float) -> None:
+        dead = [k for k, (expires_at, _) in self._data.items() if now > expires_at]
+        for k in dead:
+            del self._data[k]
+        self.expired += len(dead)
+        self._next_sweep = now + self.sweep_s
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            kinds: Dict[str, int] = {}
+            for k in self._data:
+                kinds[str(k[0])] = kinds.get(str(k[0]), 0) + 1
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "by_kind": kinds,
+                "disk": str(self.disk.path) if self.disk is not None else None,
+            }
+
+def _open_disk_cache() -> _DiskCache | None:
+    if not CACHE_PATH:
+        return None
+    try:
+        return _DiskCache(Path(CACHE_PATH))
+    except (OSError, sqlite3.Error) as e:
+        print(f"[Skola24] WARN: diskcache avstängd ({CACHE_PATH}): {e}", file=sys.stderr)
+        return None
+
+cache = _Cache(disk=_open_disk_cache())
+
+_lookup_lock = threading.Lock()
+_lookup_refreshing: set = set()
+
+
+def _cached_lookup(ck: Tuple, fetch: Callable[[], Any]) -> Any:
+    """
+    Långlivat uppslag: första anropet hämtar synkront, därefter returneras
+    cachat värde direkt. Är det äldre än LOOKUP_REFRESH_S hämtas det om i en
+    bakgrundstråd (max en åt gången per nyckel); misslyckas det ligger det
+    gamla värdet kvar tills LOOKUP_TTL gått ut.
+    """
+    item = cache.get(ck)
+    if item is None:
+        value = fetch()
+        cache.set(ck, (_time.time(), value), ttl=LOOKUP_TTL)
+        return value
+    fetched_at, value = item
+    if _time.time() - fetched_at > LOOKUP_REFRESH_S:
+        _in_background(ck, lambda: cache.set(ck, (_time.time(), fetch()), ttl=LOOKUP_TTL))
+    return value
+
+
+def _in_background(ck: Tuple, work: Callable[[], Any]) -> None:
+    """Kör work i en bakgrundstråd, högst en åt gången per nyckel; fel loggas."""
+    with _lookup_lock:
+        if ck in _lookup_refreshing:
+            return
+        _lookup_refreshing.add(ck)
+
+    def run() -> None:
+        try:
+            work()
+        except Exception as e:
+            print(f"[Skola24] WARN: bakgrundsuppdatering {ck[0]} misslyckades: {e}", file=sys.stderr)
+        finally:
+            with _lookup_lock:
+                _lookup_refreshing.discard(ck)
+
+    threading.Thread(target=run, name=f"skola24-{ck[0]}", daemon=True).start()
 
-cache = _Cache()
 
 # -------------------- HTTP helper --------------------
 
 def _post(url: str, json_body: Any) -> dict:
-    r = sess.post(url, json=json_body, headers=COMMON_HEADERS, timeout=30)
+    r = _upstream_post(url, json_body)
     if not r.ok:
         abort(r.status_code, description=f"Skola24 fel {r.status_code} vid POST {url}")
     try:
@@ -158,9 +451,70 @@ def encrypt_signature(text: str) -> str:
     return data["data"]["signature"]
 
 
+def class_signature(klass: str) -> str:
+    """Krypterad signatur för klassnamnet; ändras aldrig, så den memoiseras."""
+    ck = ("signature", HOST, klass)
+    sig = cache.get(ck)
+    if sig is None:
+        with _signature_lock:  # parallella veckor väntar in samma anrop
+            sig = cache.get(ck)
+            if sig is None:
+                sig = encrypt_signature(klass)
+                cache.set(ck, sig, ttl=LOOKUP_TTL)
+    return sig
+
+
 def get_render_key() -> str:
-    data = _post(URL_RENDER_KEY, {})
-    return data["data"]["key"]
+    """Render-nyckel som delas av alla renderingar i RENDER_KEY_TTL sekunder."""
+    global _render_key
+    with _render_key_lock:
+        if _render_key is None or _time.time() - _render_key[0] > RENDER_KEY_TTL:
+            data = _post(URL_RENDER_KEY, {})
+            _render_key = (_time.time(), data["data"]["key"])
+        return _render_key[1]
+
+
+def invalidate_render_key(stale: str) -> None:
+    """Släpp en avvisad nyckel (bara om ingen annan tråd redan bytt ut den)."""
+    global _render_key
+    with _render_key_lock:
+        if _render_key is not None and _render_key[1] == stale:
+            _render_key = None
+
+
+_signature_lock = threading.Lock()
+_render_key_lock = threading.Lock()
+_render_key: Tuple[float, str] | None = None
+
+
+def _render_post(body: dict) -> dict | None:
+    """
+    POST mot render-endpointen. None betyder att Skola24 avvisade render-nyckeln
+    (401/403, eller en validering som gäller nyckeln); övriga fel avbryter som
+    _post. Andra valideringar (t.ex. veckor utan schema) ger data utan
+    lessonInfo, alltså inga lektioner.
+    """
+    r = _upstream_post(URL_RENDER, body)
+    if r.status_code in (401, 403):
+        return None
+    if not r.ok:
+        abort(r.status_code, description=f"Skola24 fel {r.status_code} vid POST {URL_RENDER}")
+    try:
+        data = r.json()
+    except Exception as e:
+        abort(502, description=f"Kunde inte tolka JSON från {URL_RENDER}: {e}")
+    if (data.get("data") or {}).get("lessonInfo") is None and _rejects_render_key(data):
+        return None
+    return data
+
+
+def _rejects_render_key(data: dict) -> bool:
+    """Sant om valideringen/felet i svaret handlar om render-nyckeln."""
+    parts = [data.get("exceptionMessage")]
+    for v in data.get("validation") or []:
+        parts += [v.get("code"), v.get("message")] if isinstance(v, dict) else [v]
+    text = " ".join(str(p) for p in parts if p).replace(" ", "").casefold()
+    return "renderkey" in text
 
 
 def _norm(s: str) -> str:
@@ -204,16 +558,13 @@ def _extract_active_school_year(data: dict) -> int | None:
 
 
 def get_unit_guid() -> str:
-    ck = ("unit_guid", HOST, SCHOOL_NAME)
-    cached = cache.get(ck)
-    if cached:
-        return cached
-
     env_guid = os.getenv("SKOLA24_UNIT_GUID")
     if env_guid:
-        cache.set(ck, env_guid)
         return env_guid
+    return _cached_lookup(("unit_guid", HOST, SCHOOL_NAME), _fetch_unit_guid)
 
+
+def _fetch_unit_guid() -> str:
     units: List[dict] = []
     # Prefer services URL with wrapped body
     try:
@@ -245,14 +596,12 @@ def get_unit_guid() -> str:
         if _norm(name) == wanted:
             guid = u.get("unitGuid")
             if guid:
-                cache.set(ck, guid)
                 return guid
     for u in units:
         name = (u.get("unitName") or u.get("unitId") or "").strip()
         if wanted in _norm(name):
             guid = u.get("unitGuid")
             if guid:
-                cache.set(ck, guid)
                 return guid
 
     names = ", ".join(sorted({(u.get("unitName") or u.get("unitId") or "").strip() for u in units}))
@@ -298,14 +647,23 @@ def get_active_school_year() -> int:
     return year
 
 
-def render_week(klass: str, iso_year: int, school_year: int | str, week: int, unit_guid: str, class_guid: str | None = None) -> list[dict]:
+def render_week(klass: str, iso_year: int, school_year: int | str, week: int, unit_guid: str,
+                class_guid: str | None = None, force: bool = False) -> list[dict]:
+    """force=True renderar om innevarande/kommande veckor trots cache (passerade ändras inte)."""
     ck = ("render", HOST, klass, iso_year, week, str(school_year), unit_guid, class_guid or "")
-    cached = cache.get(ck)
-    if cached is not None:
-        return cached
-
-    rk = get_render_key()
-
+    past = date.fromisocalendar(iso_year, week, 7) < date.today()
+    _sync_generation()
+    if not force or past:
+        cached = cache.get(ck)
+        if cached is not None:
+            return cached
+    # Samtidiga missar på samma vecka delar på ett uppströmsanrop
+    return _render_flight.do(ck, _render_week_upstream, ck, klass, iso_year, school_year, week,
+                             unit_guid, class_guid, past)
+
+
+def _render_week_upstream(ck: Tuple, klass: str, iso_year: int, school_year: int | str, week: int,
+                          unit_guid: str, class_guid: str | None, past: bool) -> list[dict]:
     # 1) Första prio: explicit class_guid (query-param eller klass-specifik env)
     # 2) Andra prio: global SKOLA24_CLASS_GUID (bakåtkompatibelt)
     # 3) Annars: signatur på klassnamn (selectionType 4)
@@ -317,7 +675,7 @@ def render_week(klass: str, iso_year: int, school_year: int | str, week: int, un
         selection = cg
         selection_type = 0
     else:
-        selection = encrypt_signature(klass)
+        selection = class_signature(klass)
         selection_type = 4
 
     body = {
@@ -329,7 +687,7 @@ def render_week(klass: str, iso_year: int, school_year: int | str, week: int, un
         "periodText": "",
         "privateFreeTextMode": False,
         "privateSelectionMode": None,
-        "renderKey": rk,
+        "renderKey": None,
         "scheduleDay": 0,
         "schoolYear": school_year,
         "selection": selection,
@@ -341,12 +699,52 @@ def render_week(klass: str, iso_year: int, school_year: int | str, week: int, un
         "width": 1200,
         "year": iso_year,
     }
-    data = _post(URL_RENDER, body)
+    # Delad nyckel först; avvisas den hämtas en ny och anropet görs om en gång
+    data = None
+    for _ in range(2):
+        body["renderKey"] = get_render_key()
+        data = _render_post(body)
+        if data is not None:
+            break
+        invalidate_render_key(body["renderKey"])
+    if data is None:
+        abort(502, description="Skola24 avvisade render-anropet även med ny render-nyckel")
     lessons = (data.get("data") or {}).get("lessonInfo") or []
-    cache.set(ck, lessons)
+    # Veckor som redan passerat ändras inte → nästan permanent TTL
+    cache.set(ck, lessons, ttl=PAST_WEEK_TTL if past else CACHE_TTL)
     return lessons
 
 
+# Trådar skapas först vid första submit, alltså efter gunicorns fork
+_render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="skola24-render")
+_render_flight = SingleFlight()
+
+
+def render_batch(classes: List[Tuple[str, str | None]], pairs: List[Tuple[int, int]], school_year: int | str,
+                 unit_guid: str, force: bool = False) -> Dict[Tuple[str, int, int], list[dict]]:
+    """
+    Renderar alla (klass, vecka)-par i en parallell omgång: (klass, år, vecka) → lektioner,
+    i klass- och veckoordning. Ett par som fallerar hoppas över (med varning);
+    bara om alla fallerar kastas första felet vidare.
+    """
+    futures = [
+        ((klass, y, w), _render_pool.submit(render_week, klass, y, school_year, w, unit_guid, class_guid, force))
+        for klass, class_guid in classes
+        for (y, w) in pairs
+    ]
+    out: Dict[Tuple[str, int, int], list[dict]] = {}
+    first_error: Exception | None = None
+    for (klass, y, w), fut in futures:
+        try:
+            out[(klass, y, w)] = fut.result()
+        except Exception as e:
+            first_error = first_error or e
+            print(f"[Skola24] WARN: vecka {y}-W{w:02d} för {klass} misslyckades: {e}", file=sys.stderr)
+    if not out and first_error is not None:
+        raise first_error
+    return out
+
+
 
 # -------------------- Date & ICS helpers --------------------
 
@@ -373,6 +771,16 @@ def local_time_to_utc(dt_date: date, hhmm: str) -> str:
     """
     Tar emot 'HH:MM' eller 'HH:MM:SS' och returnerar UTC i ICS-format (Z).
     """
+    utc_dt = local_datetime(dt_date, hhmm).astimezone(TZ_UTC)
+    return utc_dt.strftime("%Y%m%dT%H%M%SZ")
+
+
+def local_datetime(dt_date: date, hhmm: str) -> datetime:
+    """'HH:MM' eller 'HH:MM:SS' en given dag som tz-aware lokal tid."""
+    return datetime.combine(dt_date, _parse_hhmm(hhmm), tzinfo=TZ_LOCAL)
+
+
+def _parse_hhmm(hhmm: str) -> dtime:
     if not hhmm:
         raise ValueError("Empty time string")
     parts = hhmm.strip().split(":")
@@ -382,9 +790,28 @@ def local_time_to_utc(dt_date: date, hhmm: str) -> str:
         s = int(parts[2]) if len(parts) >= 3 else 0
     except Exception as e:
         raise ValueError(f"Bad time '{hhmm}': {e}")
-    local_dt = datetime.combine(dt_date, dtime(hour=h, minute=m, second=s), tzinfo=TZ_LOCAL)
-    utc_dt = local_dt.astimezone(TZ_UTC)
-    return utc_dt.strftime("%Y%m%dT%H%M%SZ")
+    return dtime(hour=h, minute=m, second=s)
+
+
+def _utc_formatter(d: date) -> Callable[[str], str]:
+    """
+    Som local_time_to_utc för en given dag, men UTC-offseten slås upp en gång
+    (vid lunch) och varje klockslag formateras bara en gång. Sommartidsbytet
+    sker natten mot söndag, så en skoldags lektioner har alltid samma offset.
+    """
+    offset = datetime.combine(d, dtime(12), tzinfo=TZ_LOCAL).utcoffset() or timedelta(0)
+    midnight_utc = datetime.combine(d, dtime()) - offset
+    memo: Dict[str, str] = {}
+
+    def fmt(hhmm: str) -> str:
+        out = memo.get(hhmm)
+        if out is None:
+            t = _parse_hhmm(hhmm)
+            u = midnight_utc + timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+            out = memo[hhmm] = f"{u.year:04d}{u.month:02d}{u.day:02d}T{u.hour:02d}{u.minute:02d}{u.second:02d}Z"
+        return out
+
+    return fmt
 
 
 def fold_lesson_texts(texts: List[str]) -> Tuple[str, str, str]:
@@ -396,17 +823,29 @@ def fold_lesson_texts(texts: List[str]) -> Tuple[str, str, str]:
     return subject, room, (desc or subject)
 
 
-def build_ics(klass: str, lessons_by_day: Dict[date, List[dict]]) -> str:
-    dtstamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    lines = [
-        "BEGIN:VCALENDAR",
-        "VERSION:2.0",
-        "PRODID:-//family-wall//skola24-ics//EN",
-        "CALSCALE:GREGORIAN",
-        f"X-WR-CALNAME:{klass} ({SCHOOL_NAME})",
-        "X-WR-TIMEZONE:Europe/Stockholm",
-    ]
+def lessons_by_day(week_lessons: Dict[Tuple[int, int], List[dict]]) -> Dict[date, List[dict]]:
+    """(år, vecka) → lektioner  ⇒  datum → lektioner (mån–fre, datumsorterat). Ett varv per vecka."""
+    by_day: Dict[date, List[dict]] = {}
+    for (y, w), lessons in week_lessons.items():
+        days: Dict[int, List[dict]] = {}
+        for li in lessons:
+            weekday = li.get("dayOfWeekNumber")
+            if weekday in _SCHOOL_DAYS:
+                days.setdefault(weekday, []).append(li)
+        for weekday, day_items in days.items():
+            by_day.setdefault(date.fromisocalendar(y, w, weekday), []).extend(day_items)
+    return dict(sorted(by_day.items()))
+
+
+_SCHOOL_DAYS = frozenset(range(1, 6))
+
+
+def _iter_vevents(klass: str, lessons_by_day: Dict[date, List[dict]], dtstamp: str,
+                  category: str | None = None) -> Iterator[str]:
+    """En VEVENT i taget (rader utan avslutande CRLF)."""
     for d, lessons in lessons_by_day.items():
+        to_utc = _utc_formatter(d)
+        ymd = f"{d.year:04d}{d.month:02d}{d.day:02d}"
         for item in lessons:
             start = item.get("timeStart")
             end = item.get("timeEnd")
@@ -415,24 +854,121 @@ def build_ics(klass: str, lessons_by_day: Dict[date, List[dict]]) -> str:
             guid = item.get("guidId") or f"{klass}-{d.isoformat()}-{start}"
             subject, room, desc = fold_lesson_texts(item.get("texts") or [])
             summary = f"{klass} {subject}"
-            lines += [
+            # I en sammanslagen kalender kan samma lektion finnas för flera klasser
+            uid = f"{klass}-{guid}" if category else guid
+            lines = [
                 "BEGIN:VEVENT",
                 f"DTSTAMP:{dtstamp}",
-                f"UID:{guid}-{d.strftime('%Y%m%d')}",
+                f"UID:{uid}-{ymd}",
                 f"SUMMARY:{summary}",
-                f"DTSTART:{local_time_to_utc(d, start)}",
-                f"DTEND:{local_time_to_utc(d, end)}",
+                f"DTSTART:{to_utc(start)}",
+                f"DTEND:{to_utc(end)}",
             ]
+            if category:
+                lines.append(f"CATEGORIES:{category}")
             if room:
                 lines.append(f"LOCATION:{room}")
             lines.append(f"DESCRIPTION:{desc}")
             if subject == "Gråtid":
                 lines.append("TRANSP:TRANSPARENT")
             lines.append("END:VEVENT")
-    lines.append("END:VCALENDAR")
-    return "\r\n".join(lines)
+            yield "\r\n".join(lines)
+
+
+def iter_ics(classes: List[str], per_class: Iterable[Tuple[str, Dict[date, List[dict]]]]) -> Iterator[str]:
+    """
+    ICS-texten i bitar (huvud, en bit per VEVENT, fot); ihopfogad blir den
+    identisk med build_ics. per_class kan vara en generator, så att varje
+    klass dagindelas först när den skrivs. Fler än en klass → CATEGORIES per
+    klass.
+    """
+    multi = len(classes) > 1
+    dtstamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    yield "\r\n".join([
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//family-wall//skola24-ics//EN",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{' + '.join(classes)} ({SCHOOL_NAME})",
+        "X-WR-TIMEZONE:Europe/Stockholm",
+    ])
+    for klass, by_day in per_class:
+        for vevent in _iter_vevents(klass, by_day, dtstamp, category=klass if multi else None):
+            yield "\r\n" + vevent
+    yield "\r\nEND:VCALENDAR"
+
+
+def build_ics(klass: str, lessons_by_day: Dict[date, List[dict]]) -> str:
+    return "".join(iter_ics([klass], [(klass, lessons_by_day)]))
+
+
+def lesson_dicts(klass: str, lessons_by_day: Dict[date, List[dict]]) -> List[dict]:
+    """Strukturerade lektioner med samma id/summary/tider som VEVENT:en i build_ics."""
+    out: List[dict] = []
+    for d, lessons in lessons_by_day.items():
+        for item in lessons:
+            start = item.get("timeStart")
+            end = item.get("timeEnd")
+            if not start or not end:
+                continue
+            guid = item.get("guidId") or f"{klass}-{d.isoformat()}-{start}"
+            subject, room, desc = fold_lesson_texts(item.get("texts") or [])
+            out.append({
+                "id": f"{guid}-{d.strftime('%Y%m%d')}",
+                "class": klass,
+                "date": d.isoformat(),
+                "start": local_datetime(d, start).isoformat(),
+                "end": local_datetime(d, end).isoformat(),
+                "summary": f"{klass} {subject}",
+                "subject": subject,
+                "room": room,
+                "description": desc,
+                "transparent": subject == "Gråtid",
+            })
+    return out
+
+
+def lessons_for_classes(classes: List[str], weeks_back: int = DEFAULT_WEEKS_BACK,
+                        weeks_ahead: int = DEFAULT_WEEKS_AHEAD) -> List[dict]:
+    """
+    Lektioner för klasserna i veckofönstret, direkt ur render-cachen (samma
+    parallella omgång som ICS-bygget). Används av /lessons och av planera_api:s
+    skola24:-källor, så att /api/events slipper ICS-text och iCal-parsning.
+    """
+    with_guids = _with_class_guids(classes)
+    pairs = weeks_range(date.today(), weeks_back, weeks_ahead)
+    unit_guid = get_unit_guid()
+    school_year = os.getenv("SKOLA24_SCHOOL_YEAR_GUID") or get_active_school_year_guid()
+    rendered = render_batch(with_guids, pairs, school_year, unit_guid)
+    out: List[dict] = []
+    for klass, _ in with_guids:
+        weeks = {(y, w): rendered[(klass, y, w)] for (y, w) in pairs if (klass, y, w) in rendered}
+        out += lesson_dicts(klass, lessons_by_day(weeks))
+    return out
 
 # -------------------- Routes --------------------
+@skola24_bp.route("/lessons", methods=["GET"], strict_slashes=False)
+@skola24_bp.route("/lessons/<klass>", methods=["GET"], strict_slashes=False)
+def lessons_json(klass: str | None = None):
+    """Lektioner som JSON: /lessons/<klass> eller /lessons?classes=A,B (default SKOLA24_CLASSES)."""
+    if klass:
+        classes = [klass.strip()]
+    else:
+        names = request.args.get("classes")
+        classes = [c.strip() for c in names.split(",") if c.strip()] if names else list(DEFAULT_CLASSES)
+    if not classes or not all(classes):
+        abort(400, description="Ange klass")
+
+    try:
+        weeks_back = int(request.args.get("weeks_back", DEFAULT_WEEKS_BACK))
+        weeks_ahead = int(request.args.get("weeks_ahead", DEFAULT_WEEKS_AHEAD))
+    except ValueError:
+        abort(400, description="weeks_back/weeks_ahead måste vara heltal")
+
+    body = json.dumps(lessons_for_classes(classes, weeks_back, weeks_ahead), separators=(",", ":")).encode("utf-8")
+    return conditional_response(CachedBody(body), "application/json", {"Cache-Control": "no-cache"})
+
+
 @skola24_bp.route("/ics/<klass>", methods=["GET"], strict_slashes=False)
 def ics_for_class(klass: str):
     klass = (klass or "").strip()
@@ -450,33 +986,335 @@ def ics_for_class(klass: str):
                   os.getenv(f"SKOLA24_CLASS_GUID_{klass}", "").strip() or
                   None)
 
-    today = date.today()
-    pairs = weeks_range(today, weeks_back, weeks_ahead)
-
-    unit_guid = get_unit_guid()
-    school_year = os.getenv("SKOLA24_SCHOOL_YEAR_GUID") or get_active_school_year_guid()
+    headers = {
+        "Content-Disposition": f'attachment; filename="{klass}.ics"',
+        "Cache-Control": "public, max-age=600",
+    }
+    return _serve_ics([(klass, class_guid)], weeks_back, weeks_ahead, headers)
 
-    all_lessons = {}
-    for (iso_year, w) in pairs:
-        all_lessons[(iso_year, w)] = render_week(
-            klass, iso_year, school_year, w, unit_guid, class_guid=class_guid
-        )
 
-    lessons_by_day: Dict[date, List[dict]] = {}
-    for (y, w), lessons in all_lessons.items():
-        for weekday in range(1, 6):
-            d = date.fromisocalendar(y, w, weekday)
-            day_items = [li for li in lessons if li.get("dayOfWeekNumber") == weekday]
-            if day_items:
-                lessons_by_day.setdefault(d, []).extend(day_items)
+@skola24_bp.route("/ics", methods=["GET"], strict_slashes=False)
+def ics_combined():
+    """
+    En sammanslagen kalender för flera klasser: /ics?classes=A,B (default
+    SKOLA24_CLASSES). Uppslag görs en gång och alla (klass, vecka) renderas
+    i samma parallella omgång; lektionerna märks med klassen i CATEGORIES.
+    """
+    names = request.args.get("classes")
+    classes = [c.strip() for c in names.split(",") if c.strip()] if names else list(DEFAULT_CLASSES)
+    if not classes:
+        abort(400, description="Ange classes=A,B")
 
-    ics = build_ics(klass, dict(sorted(lessons_by_day.items())))
+    try:
+        weeks_back = int(request.args.get("weeks_back", DEFAULT_WEEKS_BACK))
+        weeks_ahead = int(request.args.get("weeks_ahead", DEFAULT_WEEKS_AHEAD))
+    except ValueError:
+        abort(400, description="weeks_back/weeks_ahead måste vara heltal")
 
     headers = {
-        "Content-Disposition": f'attachment; filename="{klass}.ics"',
+        "Content-Disposition": f'attachment; filename="{"-".join(classes)}.ics"',
         "Cache-Control": "public, max-age=600",
     }
-    return Response(ics, mimetype="text/calendar; charset=utf-8", headers=headers)
+    return _serve_ics(_with_class_guids(classes), weeks_back, weeks_ahead, headers)
+
+
+def _with_class_guids(classes: List[str]) -> List[Tuple[str, str | None]]:
+    return [(k, os.getenv(f"SKOLA24_CLASS_GUID_{k}", "").strip() or None) for k in classes]
+
+
+def _latest_key(classes: List[Tuple[str, str | None]], weeks_back: int, weeks_ahead: int) -> Tuple:
+    return ("ics_latest", HOST, tuple((k, cg or "") for k, cg in classes), weeks_back, weeks_ahead)
+
+
+def _serve_ics(classes: List[Tuple[str, str | None]], weeks_back: int, weeks_ahead: int,
+               headers: Dict[str, str]) -> Response:
+    """
+    Senaste/förrenderade kroppen (stark ETag, gzip, 304). Bara ett stort
+    fönster utan färdig kropp strömmas – och byggs samtidigt i bakgrunden,
+    så att nästa anrop får den cachade kroppen.
+    """
+    lk = _latest_key(classes, weeks_back, weeks_ahead)
+    if weeks_back + weeks_ahead + 1 >= STREAM_MIN_WEEKS and _get_latest(lk) is None:
+        _in_background(lk, lambda: build_classes_ics(classes, weeks_back, weeks_ahead, retry_partial=False))
+        return _stream_ics(classes, weeks_back, weeks_ahead, headers)
+    cached = _serve_latest(classes, weeks_back, weeks_ahead)
+    return conditional_response(cached, ICS_MIMETYPE, headers)
+
+
+def _serve_latest(classes: List[Tuple[str, str | None]], weeks_back: int, weeks_ahead: int) -> CachedBody:
+    """
+    Senast byggda kropp serveras direkt; är den från en tidigare dag, äldre än
+    CACHE_TTL eller ofullständig byggs en ny i bakgrunden. Bara kall start
+    (ingen kropp i minnet eller i diskcachen) väntar.
+    """
+    lk = _latest_key(classes, weeks_back, weeks_ahead)
+    latest = _get_latest(lk)
+    if latest is None:
+        return build_classes_ics(classes, weeks_back, weeks_ahead)
+    built_at, built_on, cached, complete = latest
+    if not complete or built_on != date.today().isoformat() or _time.time() - built_at > CACHE_TTL:
+        _in_background(lk, lambda: build_classes_ics(classes, weeks_back, weeks_ahead, retry_partial=False))
+    return cached
+
+
+def _get_latest(lk: Tuple) -> Tuple | None:
+    """
+    Senaste kroppen ur minnet, annars den senaste kompletta ur diskcachen
+    (skriven av en annan worker eller före omstart) – som då läggs i minnet.
+    """
+    _sync_generation()
+    latest = cache.get(lk)
+    if latest is not None or cache.disk is None:
+        return latest
+    item = cache.disk.get(lk)
+    now = _time.time()
+    if item is None or now > item[0]:
+        return None
+    built_at, built_on, body, etag = item[1]
+    latest = (built_at, built_on, CachedBody(body.encode("utf-8"), etag), True)
+    cache.set(lk, latest, ttl=int(item[0] - now))
+    return latest
+
+
+def build_class_ics(klass: str, weeks_back: int, weeks_ahead: int, class_guid: str | None = None,
+                    force: bool = False) -> CachedBody:
+    """ICS-kroppen för en klass (se build_classes_ics)."""
+    return build_classes_ics([(klass, class_guid)], weeks_back, weeks_ahead, force=force)
+
+
+def _render_classes(classes: List[Tuple[str, str | None]], pairs: List[Tuple[int, int]], force: bool = False
+                    ) -> Tuple[List[Tuple[str, Dict[Tuple[int, int], list[dict]]]], str, bool]:
+    """
+    Renderar alla (klass, vecka) och returnerar (per klass: vecka → lektioner,
+    innehållssignatur, om alla veckor renderades).
+    """
+    unit_guid = get_unit_guid()
+    school_year = os.getenv("SKOLA24_SCHOOL_YEAR_GUID") or get_active_school_year_guid()
+
+    rendered = render_batch(classes, pairs, school_year, unit_guid, force=force)
+    per_class = [
+        (klass, {(y, w): rendered[(klass, y, w)] for (y, w) in pairs if (klass, y, w) in rendered})
+        for klass, _ in classes
+    ]
+    # Hasha vecka för vecka i stället för att serialisera hela fönstret på en gång
+    h = hashlib.sha1()
+    for klass, weeks in per_class:
+        h.update(f"\x00{klass}".encode("utf-8"))
+        for (y, w) in sorted(weeks):
+            h.update(f"\x01{y}-{w}".encode("ascii"))
+            h.update(json.dumps(weeks[(y, w)], sort_keys=True, default=str).encode("utf-8"))
+    lessons_sig = h.hexdigest()
+    return per_class, lessons_sig, len(rendered) == len(classes) * len(pairs)
+
+
+def build_classes_ics(classes: List[Tuple[str, str | None]], weeks_back: int, weeks_ahead: int,
+                      force: bool = False, retry_partial: bool = True) -> CachedBody:
+    """
+    Renderar veckofönstret för en eller flera klasser och bygger ICS-kroppen.
+    Resultatet sparas även som senaste kropp (ics_latest) som routen serverar;
+    en komplett kropp skrivs också till diskcachen, så att en ny eller
+    omstartad worker kan servera den direkt.
+    Saknas någon vecka (fel hos Skola24) sparas den bara PARTIAL_RETRY_S och,
+    med retry_partial, renderas om i bakgrunden direkt.
+    """
+    today = date.today()
+    pairs = weeks_range(today, weeks_back, weeks_ahead)
+    per_class, lessons_sig, complete = _render_classes(classes, pairs, force=force)
+
+    # ETag ur lektionsdata + fönster; färdig kropp cachas så att DTSTAMP (och
+    # därmed ETag/gzip) är stabil tills schemat faktiskt ändras
+    ck = ("ics_body", HOST, tuple(classes), tuple(pairs), lessons_sig)
+    cached = cache.get(ck)
+    if cached is None:
+        ics = "".join(iter_ics([k for k, _ in per_class], ((k, lessons_by_day(weeks)) for k, weeks in per_class)))
+        cached = CachedBody(ics.encode("utf-8"), "s24-" + make_tag(*ck))
+        cache.set(ck, cached)
+
+    lk = _latest_key(classes, weeks_back, weeks_ahead)
+    built_at = _time.time()
+    cache.set(lk, (built_at, today.isoformat(), cached, complete), ttl=LOOKUP_TTL if complete else PARTIAL_RETRY_S)
+    if complete and cache.disk is not None:
+        cache.disk.set(lk, built_at + LOOKUP_TTL,
+                       [built_at, today.isoformat(), cached.body.decode("utf-8"), cached.etag])
+    if not complete and retry_partial:
+        _in_background(lk, lambda: build_classes_ics(classes, weeks_back, weeks_ahead, retry_partial=False))
+    return cached
+
+
+def _stream_ics(classes: List[Tuple[str, str | None]], weeks_back: int, weeks_ahead: int,
+                headers: Dict[str, str]) -> Response:
+    """
+    Långa fönster utan färdig kropp skrivs ut en VEVENT i taget (en klass
+    dagindelas först när den skrivs), gzip:at i farten om klienten tillåter.
+    DTSTAMP skiljer mellan svar, så ETag:en är svag och bygger bara på
+    lektionsdatan.
+    """
+    pairs = weeks_range(date.today(), weeks_back, weeks_ahead)
+    per_class, lessons_sig, _ = _render_classes(classes, pairs)
+    use_gzip = request.accept_encodings.quality("gzip") > 0
+    etag = "s24-" + make_tag("stream", HOST, tuple(classes), tuple(pairs), lessons_sig)
+    if use_gzip:
+        etag += "-gz"
+
+    hdrs = dict(headers)
+    hdrs["ETag"] = f'W/"{etag}"'
+    hdrs["Vary"] = "Accept-Encoding"
+    if request.if_none_match.contains_weak(etag):
+        hdrs.pop("Content-Disposition", None)
+        return Response(status=304, headers=hdrs)
+
+    def generate() -> Iterator[bytes]:
+        day_split = ((k, lessons_by_day(weeks)) for k, weeks in per_class)
+        for chunk in iter_ics([k for k, _ in per_class], day_split):
+            yield chunk.encode("utf-8")
+
+    def generate_gzip() -> Iterator[bytes]:
+        z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 → gzip-format
+        for chunk in generate():
+            out = z.compress(chunk)
+            if out:
+                yield out
+        yield z.flush()
+
+    if use_gzip:
+        hdrs["Content-Encoding"] = "gzip"
+        return Response(generate_gzip(), mimetype=ICS_MIMETYPE, headers=hdrs)
+    return Response(generate(), mimetype=ICS_MIMETYPE, headers=hdrs)
+
+
+# -------------------- Förrendering (schemalagd) --------------------
+
+_prerender_started = False
+_prerender_start_lock = threading.Lock()
+_prerender_lock_fd = None
+
+
+def _next_prerender(now: datetime) -> datetime:
+    """Nästa schemalagda körning: PRERENDER_NIGHTLY varje dag, PRERENDER_MORNING mån–fre."""
+    candidates = []
+    for offset in range(8):
+        d = now.date() + timedelta(days=offset)
+        for hhmm, weekdays_only in ((PRERENDER_NIGHTLY, False), (PRERENDER_MORNING, True)):
+            if not hhmm or (weekdays_only and d.weekday() >= 5):
+                continue
+            h, m = (int(x) for x in hhmm.split(":")[:2])
+            at = datetime.combine(d, dtime(hour=h, minute=m), tzinfo=TZ_LOCAL)
+            if at > now:
+                candidates.append(at)
+    return min(candidates)
+
+
+def prerender_all(force: bool = False) -> None:
+    """
+    Bygg ICS-kroppar för alla DEFAULT_CLASSES med standardfönstret, en per klass
+    och den sammanslagna (som då bara läser de nyss renderade veckorna ur cachen).
+    """
+    for klass, class_guid in _with_class_guids(DEFAULT_CLASSES):
+        try:
+            build_class_ics(klass, DEFAULT_WEEKS_BACK, DEFAULT_WEEKS_AHEAD, class_guid, force=force)
+        except Exception as e:
+            print(f"[Skola24] WARN: förrendering av {klass} misslyckades: {e}", file=sys.stderr)
+    if len(DEFAULT_CLASSES) > 1:
+        try:
+            build_classes_ics(_with_class_guids(DEFAULT_CLASSES), DEFAULT_WEEKS_BACK, DEFAULT_WEEKS_AHEAD)
+        except Exception as e:
+            print(f"[Skola24] WARN: förrendering av {','.join(DEFAULT_CLASSES)} misslyckades: {e}", file=sys.stderr)
+    if force:
+        _publish_generation()
+
+
+_GENERATION_KEY = ("prerender_generation", HOST)
+_generation_seen = 0.0
+_generation_checked_at = float("-inf")
+
+
+def _publish_generation() -> None:
+    """Märk diskcachen med en ny generation efter en forcerad förrendering."""
+    global _generation_seen
+    if cache.disk is None:
+        return
+    gen = _time.time()
+    _generation_seen = gen
+    cache.disk.set(_GENERATION_KEY, gen + LOOKUP_TTL, gen)
+
+
+def _sync_generation() -> None:
+    """
+    Högst var GENERATION_CHECK_S: har förrenderingen publicerat en nyare
+    generation än den här workern sett släpps renderingar och senaste kroppar
+    i minnet, så att nästa anrop läser de nya ur diskcachen.
+    """
+    global _generation_seen, _generation_checked_at
+    if cache.disk is None:
+        return
+    now = _time.monotonic()
+    if now - _generation_checked_at < GENERATION_CHECK_S:
+        return
+    _generation_checked_at = now
+    item = cache.disk.get(_GENERATION_KEY)
+    if item is None or float(item[1]) <= _generation_seen:
+        return
+    _generation_seen = float(item[1])
+    cache.drop_kinds(("render", "ics_latest"))
+
+
+def _prerender_loop() -> None:
+    # Första varvet värmer från (disk)cachen; schemalagda varv renderar om på riktigt.
+    # Fel (t.ex. ogiltig SKOLA24_PRERENDER_*-tid) loggas – tråden får inte dö.
+    _time.sleep(random.uniform(1, 15))
+    force = False
+    while True:
+        try:
+            prerender_all(force=force)
+        except Exception as e:
+            print(f"[Skola24] WARN: förrendering misslyckades: {e}", file=sys.stderr)
+        force = True
+        now = datetime.now(TZ_LOCAL)
+        try:
+            at = _next_prerender(now) + timedelta(seconds=random.uniform(0, PRERENDER_JITTER_S))
+        except Exception as e:
+            print(f"[Skola24] WARN: kunde inte beräkna nästa förrendering: {e}", file=sys.stderr)
+            at = now + timedelta(hours=24)
+        _time.sleep(max(1.0, (at - now).total_seconds()))
+
+
+def _claim_prerender() -> bool:
+    """
+    Bara en worker per maskin förrenderar: den som får ett exklusivt flock på
+    en låsfil bredvid diskcachen (hålls tills processen dör). Utan diskcache
+    förrenderar varje worker själv.
+    """
+    global _prerender_lock_fd
+    if not CACHE_PATH:
+        return True
+    try:
+        import fcntl
+    except ImportError:  # ingen flock (Windows) → varje worker förrenderar
+        return True
+    fd = None
+    try:
+        fd = open(CACHE_PATH + ".prerender.lock", "a")
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        if fd is not None:
+            fd.close()
+        return False
+    _prerender_lock_fd = fd
+    return True
+
+
+@skola24_bp.before_app_request
+def _ensure_prerender() -> None:
+    """Startar schemaläggaren lazy vid första anropet till appen (efter fork)."""
+    global _prerender_started
+    if _prerender_started or not PRERENDER_ENABLED:
+        return
+    with _prerender_start_lock:
+        if _prerender_started:
+            return
+        _prerender_started = True
+    if _claim_prerender():
+        threading.Thread(target=_prerender_loop, name="skola24-prerender", daemon=True).start()
 
 
 @skola24_bp.route("/units", methods=["GET"], strict_slashes=False)
@@ -525,7 +1363,7 @@ def units_debug():
             {},
         ):
             try:
-                r = sess.post(url, json=body, headers=COMMON_HEADERS, timeout=30)
+                r = _upstream_post(url, body)
                 try:
                     data = r.json()
                     snippet = str(data)[:300]
@@ -547,6 +1385,13 @@ def units_debug():
     })
 
 
+@skola24_bp.route("/cache/debug", methods=["GET"], strict_slashes=False)
+def cache_debug():
+    stats = cache.stats()
+    stats["render_singleflight"] = {"calls": _render_flight.calls, "coalesced": _render_flight.coalesced}
+    return jsonify(stats)
+
+
 @skola24_bp.route("/schoolyears/debug", methods=["GET"], strict_slashes=False)
 def schoolyears_debug():
     attempts: List[dict] = []
@@ -562,7 +1407,7 @@ def schoolyears_debug():
         (URL_SCHOOL_YEARS_B, {}),
     ):
         try:
-            r = sess.post(url, json=body, headers=COMMON_HEADERS, timeout=30)
+            r = _upstream_post(url, body)
             try:
                 data = r.json()
             except Exception:
@@ -593,12 +1438,13 @@ def root():
         "service": "Skola24 -> ICS",
         "host": HOST,
         "school": SCHOOL_NAME,
-        "endpoints": [f"/ics/{c}" for c in DEFAULT_CLASSES],
+        "endpoints": [f"/ics/{c}" for c in DEFAULT_CLASSES] + [f"/ics?classes={','.join(DEFAULT_CLASSES)}"],
         "defaults": {"weeks_back": DEFAULT_WEEKS_BACK, "weeks_ahead": DEFAULT_WEEKS_AHEAD},
         "tips": [
             "/skola24/units listar enheter",
             "/skola24/units/debug visar råförsök",
             "/skola24/schoolyears/debug visar årförsök",
+            "/skola24/cache/debug visar cachestorlek och träffstatistik",
             "Sätt SKOLA24_UNIT_GUID om namnsökning inte hittar rätt",
         ],
     })
@@ -666,7 +1512,7 @@ def render_attempts(klass: str):
                     "width": 1200,
                     "year": iso_year,
                 }
-                r = sess.post(URL_RENDER, json=body, headers=COMMON_HEADERS, timeout=30)
+                r = _upstream_post(URL_RENDER, body)
                 ok = r.ok
                 try:
                     data = r.json()
@@ -690,16 +1536,7 @@ def render_attempts(klass: str):
     })
 @skola24_bp.route("/classes", methods=["GET"], strict_slashes=False)
 def list_classes():
-    unit_guid = get_unit_guid()
-    body = {
-        "hostname": HOST,
-        "unitGuid": unit_guid,
-        "filters": { "class": "true" }
-    }
-    r = sess.post("https://web.skola24.se/api/get/timetable/selection", json=body, headers=COMMON_HEADERS, timeout=30)
-    r.raise_for_status()
-    data = r.json()
-    classes = (((data or {}).get("data") or {}).get("classes") or [])
+    classes = get_classes(get_unit_guid())
     return jsonify([
         {"groupName": c.get("groupName"), "groupGuid": c.get("groupGuid")}
         for c in classes
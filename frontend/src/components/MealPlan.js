@@ -13,6 +13,10 @@ const API_BASE =
 
 const api = (path) => `${API_BASE}${path}`;
 
+// Pollning av planeringsjobb (backend kör det i bakgrunden)
+const PLAN_POLL_MS = 2000;
+const PLAN_POLL_MAX_MS = 15 * 60 * 1000;
+
 // ---- Hjälp: ISO-vecka (samma som tidigare) ----
 function getWeekNumber(date) {
   const target = new Date(date.valueOf());
@@ -163,6 +167,7 @@ function MealPlan() {
   const handleNextWeek = () => setWeekNumber((prev) => prev + 1);
 
   // ---- Skapa ny veckomeny via backend (/api/ai/planera) ----
+  // Backend köar ett jobb och svarar direkt; vi pollar /api/ai/ai-status?job=<id>
   async function regenerateMealPlan() {
     const confirmed = window.confirm(
       "Är du säker på att du vill skapa en ny veckomeny? Detta ersätter den nuvarande."
@@ -172,14 +177,31 @@ function MealPlan() {
     setStatusMsg("Skapar ny veckomeny...");
     setLoading(true);
     try {
-      const data = await fetchJSON(api("/api/ai/planera"), {
+      let job = await fetchJSON(api("/api/ai/planera"), {
         method: "POST",
         headers: { "Content-Type": "application/json", Accept: "application/json" },
         body: JSON.stringify({}),
       });
+      if (!job || !job.jobId) {
+        throw new Error((job && job.message) || "Kunde inte skapa matsedel.");
+      }
+
+      const deadline = Date.now() + PLAN_POLL_MAX_MS;
+      while (job.status === "queued" || job.status === "running") {
+        if (Date.now() > deadline) {
+          throw new Error("Planeringen tar ovanligt lång tid – försök igen senare.");
+        }
+        setStatusMsg(
+          job.status === "queued"
+            ? "Väntar på att planeringen ska starta..."
+            : `Skapar ny veckomeny... ${job.progress || ""}`
+        );
+        await new Promise((r) => setTimeout(r, PLAN_POLL_MS));
+        job = await fetchJSON(api(`/api/ai/ai-status?job=${encodeURIComponent(job.jobId)}`));
+      }
 
-      if (data.status !== "ok") {
-        throw new Error(data.message || "Kunde inte skapa matsedel.");
+      if (job.status !== "done") {
+        throw new Error(job.message || "Kunde inte skapa matsedel.");
       }
       await loadWeek(weekNumber); // refetcha direkt
       playSound("new-menu.mp3");